@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# End-to-end throughput and latency benchmarks. Every result is written as
+# one JSON object per line, so runs can be compared across releases.
+
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import tty
+from collections import deque
+
+import click
+import serial
+
+from portflakes.io import SerialIO
+
+
+def percentile(values, p):
+    if not values:
+        return None
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def summarize(values):
+    if not values:
+        return {}
+
+    return {
+        'min': min(values),
+        'avg': sum(values) / len(values),
+        'p50': percentile(values, 50),
+        'p99': percentile(values, 99),
+        'max': max(values),
+    }
+
+
+def open_pty_pair():
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    tty.setraw(master)
+
+    ser = serial.serial_for_url(os.ttyname(slave))
+    return master, slave, ser
+
+
+def bench_throughput(rate, chunk_size, duration, fps):
+    master, slave, ser = open_pty_pair()
+    io = SerialIO.new_and_start(ser, fps=fps)
+
+    # (end offset of a written chunk, time it was written)
+    written = deque()
+    lock = threading.Lock()
+    received = [0]
+    latencies = []
+    depths = []
+    stop = threading.Event()
+
+    def on_received(_, data):
+        now = time.perf_counter()
+        received[0] += len(data)
+
+        with lock:
+            while written and written[0][0] <= received[0]:
+                latencies.append(now - written.popleft()[1])
+
+    io.connect('data-received', on_received)
+
+    # chunks waiting for delivery, sampled on the receive thread as every
+    # one is read, i.e. before the timer drains them
+    def tap(signal, data):
+        if signal == 'data-received':
+            depths.append(len(io._pending))
+
+    io.add_tap(tap)
+
+    def writer():
+        chunk = b'x' * chunk_size
+        interval = chunk_size / float(rate) if rate else 0
+        offset = 0
+        deadline = time.monotonic()
+
+        while not stop.is_set():
+            if interval:
+                deadline += interval
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            # stamped before writing, the reader may get the data before
+            # os.write() returns
+            with lock:
+                stamp = time.perf_counter()
+                offset += os.write(master, chunk)
+                written.append((offset, stamp))
+
+    # signals are delivered on the io's own timer thread, no main loop needed
+    t = threading.Thread(target=writer)
+    t.daemon = True
+    start = time.perf_counter()
+    t.start()
+    time.sleep(duration)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    t.join()
+
+    io.stop()
+    ser.close()
+    os.close(master)
+    os.close(slave)
+
+    return {
+        'benchmark': 'throughput',
+        'rate': rate,
+        'chunk_size': chunk_size,
+        'fps': fps,
+        'duration': elapsed,
+        'bytes': received[0],
+        'bytes_per_sec': received[0] / elapsed,
+        'latency': summarize(latencies),
+        'queue_depth': summarize(depths),
+    }
+
+
+def synthetic(kind, size):
+    if kind == 'random':
+        return os.urandom(size)
+
+    line = b'temperature=23.5 humidity=41 status=OK\r\n'
+    return (line * (size // len(line) + 1))[:size]
+
+
+def bench_view(view_cls, kind, size, repeat):
+    view = view_cls()
+    data = synthetic(kind, size)
+
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        view.append(data, 'in' if i % 2 else 'out')
+        times.append(time.perf_counter() - start)
+
+    return {
+        'benchmark': 'view',
+        'view': view_cls.__name__,
+        'payload': kind,
+        'size': size,
+        'time': summarize(times),
+        'bytes_per_sec': size * repeat / sum(times),
+    }
+
+
+def gtk_available():
+    try:
+        import gi
+        gi.require_version('Gtk', '3.0')
+        from gi.repository import Gtk
+    except (ImportError, ValueError):
+        return False
+
+    return Gtk.init_check(sys.argv)[0]
+
+
+@click.command()
+@click.option('--rate', '-r', type=int, multiple=True,
+              help='Bytes per second to send, 0 for unthrottled')
+@click.option('--chunk-size', '-c', type=int, multiple=True)
+@click.option('--duration', '-d', type=float, default=3.0)
+@click.option('--fps', type=int, default=30)
+@click.option('--views/--no-views', default=None,
+              help='Benchmark ASCIIView/HexView.append (default: whenever '
+              'GTK and a display are available)')
+@click.option('--output', '-o', type=click.File('a'), default='-')
+def main(rate, chunk_size, duration, fps, views, output):
+    if views is not False and not gtk_available():
+        if views:
+            raise click.UsageError('The view benchmarks need GTK and a '
+                                   'display')
+        click.echo('GTK or a display is missing, skipping the view '
+                   'benchmarks', err=True)
+        views = False
+
+    info = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+    }
+
+    def report(result):
+        result.update(info)
+        output.write(json.dumps(result) + '\n')
+        output.flush()
+
+    for r in rate or (0, 115200 // 10, 921600 // 10):
+        for c in chunk_size or (1, 64, 4096):
+            report(bench_throughput(r, c, duration, fps))
+
+    if views is not False:
+        from portflakes.gui import ASCIIView, HexView
+
+        for view_cls in (ASCIIView, HexView):
+            for kind in ('text', 'random'):
+                for size in (64, 4096, 65536):
+                    report(bench_view(view_cls, kind, size, 50))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# Cold start benchmarks for headless commands. Each command runs in a fresh
+# interpreter; results are written as one JSON object per line, like
+# bench_io.py.
+
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import click
+
+COMMANDS = {
+    'import-cli': ['-c', 'import portflakes.cli'],
+    'import-io': ['-c', 'import portflakes.io'],
+    'help': ['-c', 'from portflakes.cli import cli; cli()', '--help'],
+    'try-help': ['-c', 'from portflakes.cli import cli; cli()', 'try',
+                 '--help'],
+}
+
+# none of these may be loaded by the headless commands
+GUI_MODULES = ('gi', 'portflakes.gui')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def gui_modules_loaded(module):
+    code = ('import sys, {}; print(",".join(m for m in {!r} '
+            'if m in sys.modules))').format(module, GUI_MODULES)
+    out = subprocess.check_output([sys.executable, '-c', code])
+    return [m for m in out.decode('ascii').strip().split(',') if m]
+
+
+def bench_command(name, args, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable] + args,
+                              stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+
+    return {
+        'benchmark': 'startup',
+        'command': name,
+        'repeat': repeat,
+        'time': {
+            'min': min(times),
+            'avg': sum(times) / len(times),
+            'p50': percentile(times, 50),
+            'max': max(times),
+        },
+    }
+
+
+@click.command()
+@click.option('--repeat', '-n', type=int, default=20)
+@click.option('--command', '-c', 'names', multiple=True,
+              type=click.Choice(sorted(COMMANDS)))
+@click.option('--output', '-o', type=click.File('a'), default='-')
+def main(repeat, names, output):
+    info = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+    }
+
+    def report(result):
+        result.update(info)
+        output.write(json.dumps(result) + '\n')
+        output.flush()
+
+    # interpreter startup alone, as a baseline
+    report(bench_command('python', ['-c', 'pass'], repeat))
+
+    for name in names or sorted(COMMANDS):
+        report(bench_command(name, COMMANDS[name], repeat))
+
+    for module in ('portflakes.cli', 'portflakes.io'):
+        loaded = gui_modules_loaded(module)
+        report({'benchmark': 'gui-imports', 'module': module,
+                'loaded': loaded})
+
+        if loaded:
+            sys.exit('{} imports {}'.format(module, ', '.join(loaded)))
+
+
+if __name__ == '__main__':
+    main()
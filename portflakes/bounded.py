@@ -0,0 +1,85 @@
+import threading
+from collections import deque
+from queue import Empty
+
+POLICIES = ('block', 'drop-oldest', 'drop-newest')
+
+
+class BoundedQueue(object):
+    # A thread-safe FIFO limited by the total size of its items rather than
+    # their number. Once full, put() blocks, evicts the oldest items or
+    # rejects the new one, depending on the policy, and returns whatever it
+    # dropped so the caller can account for it.
+
+    def __init__(self, max_size=None, policy='block'):
+        if policy not in POLICIES:
+            raise ValueError('Unknown policy {!r}'.format(policy))
+
+        self.max_size = max_size
+        self.policy = policy
+
+        self.size = 0
+        self._items = deque()
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._items)
+
+    def qsize(self):
+        return len(self._items)
+
+    def empty(self):
+        return not self._items
+
+    def _full(self, size):
+        # a single item larger than the limit is still accepted on its own
+        return (self.max_size is not None and self._items and
+                self.size + size > self.max_size)
+
+    def put(self, item, size):
+        dropped = []
+
+        with self._cond:
+            if self._full(size):
+                if self.policy == 'drop-newest':
+                    return [(item, size)]
+
+                if self.policy == 'block':
+                    while self._full(size):
+                        self._cond.wait()
+                else:
+                    while self._full(size):
+                        old = self._items.popleft()
+                        self.size -= old[1]
+                        dropped.append(old)
+
+            self._items.append((item, size))
+            self.size += size
+            self._cond.notify_all()
+
+        return dropped
+
+    def get(self, block=True):
+        with self._cond:
+            while not self._items:
+                if not block:
+                    raise Empty()
+                self._cond.wait()
+
+            item, size = self._items.popleft()
+            self.size -= size
+            self._cond.notify_all()
+
+            return item
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def drain(self):
+        with self._cond:
+            items = [item for item, _ in self._items]
+            self._items.clear()
+            self.size = 0
+            self._cond.notify_all()
+
+            return items
@@ -0,0 +1,256 @@
+import mmap
+import os
+import struct
+import time
+from bisect import bisect_right
+
+from .store import DIRECTIONS
+from .util import read_chunk
+
+MAGIC = b'PFCAP\r\n\x1a'
+VERSION = 1
+
+# magic, version, wall clock and monotonic clock (ns) at file creation
+FILE_HEADER = struct.Struct('<8sHqQ')
+
+# monotonic timestamp (ns), direction, payload length
+RECORD_HEADER = struct.Struct('<QBI')
+
+# the sparse index is stored as a record of this direction before the footer
+DIRECTION_INDEX = 0xff
+
+# timestamp, payload bytes before the record, file offset of the record
+INDEX_ENTRY = struct.Struct('<QQQ')
+
+# file offset of the index record
+FOOTER = struct.Struct('<Q8s')
+FOOTER_MAGIC = b'PFINDEX\x00'
+
+BUFFER_SIZE = 1024 * 1024
+INDEX_INTERVAL = 64 * 1024
+
+
+class CaptureWriter(object):
+    def __init__(self, path, max_size=None, buffer_size=BUFFER_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.buffer_size = buffer_size
+
+        self.file_count = 0
+        self.total_bytes = 0
+        self._f = None
+        self._open()
+
+    def file_name(self, n):
+        if n == 0:
+            return self.path
+
+        root, ext = os.path.splitext(self.path)
+        return '{}.{}{}'.format(root, n, ext)
+
+    def _open(self):
+        self._f = open(self.file_name(self.file_count), 'wb',
+                       buffering=self.buffer_size)
+        self._f.write(FILE_HEADER.pack(MAGIC, VERSION, time.time_ns(),
+                                       time.monotonic_ns()))
+        self._size = FILE_HEADER.size
+        self._payload = 0
+        self._index = bytearray()
+        self._next_index = self._size
+        self.file_count += 1
+
+    def _close_file(self):
+        index_offset = self._size
+        self._f.write(RECORD_HEADER.pack(0, DIRECTION_INDEX,
+                                         len(self._index)))
+        self._f.write(self._index)
+        self._f.write(FOOTER.pack(index_offset, FOOTER_MAGIC))
+        self._f.close()
+
+    def write(self, data, direction='in', timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic_ns()
+
+        record_size = RECORD_HEADER.size + len(data)
+        if (self.max_size is not None and self._size > FILE_HEADER.size and
+                self._size + record_size > self.max_size):
+            self._close_file()
+            self._open()
+
+        if self._size >= self._next_index:
+            self._index += INDEX_ENTRY.pack(timestamp, self._payload,
+                                            self._size)
+            self._next_index = self._size + INDEX_INTERVAL
+
+        self._f.write(RECORD_HEADER.pack(
+            timestamp, DIRECTIONS.index(direction), len(data)))
+        self._f.write(data)
+
+        self._size += record_size
+        self._payload += len(data)
+        self.total_bytes += len(data)
+
+    def close(self):
+        if self._f is not None:
+            self._close_file()
+            self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CaptureReader(object):
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, 'rb')
+
+        try:
+            self._open()
+        except ValueError:
+            self.close()
+            raise
+
+    def _open(self):
+        # an empty file cannot even be mapped
+        if os.fstat(self._f.fileno()).st_size < FILE_HEADER.size:
+            self._mm = None
+            raise ValueError('{} is not a capture file'.format(self.path))
+
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.start_wall, self.start_monotonic = (
+            FILE_HEADER.unpack_from(self._mm, 0))
+        if magic != MAGIC:
+            raise ValueError('{} is not a capture file'.format(self.path))
+        if version != VERSION:
+            raise ValueError('Unsupported capture version {}'.format(version))
+
+        self._load_index()
+
+    def _load_index(self):
+        mm = self._mm
+        self.end = len(mm)
+
+        if len(mm) >= FILE_HEADER.size + FOOTER.size:
+            index_offset, magic = FOOTER.unpack_from(mm, len(mm) - FOOTER.size)
+        else:
+            magic = None
+
+        if magic == FOOTER_MAGIC:
+            _, _, length = RECORD_HEADER.unpack_from(mm, index_offset)
+            start = index_offset + RECORD_HEADER.size
+            entries = list(INDEX_ENTRY.iter_unpack(mm[start:start + length]))
+            self.end = index_offset
+        else:
+            # unterminated capture, e.g. after a crash: rebuild by scanning
+            entries = []
+            next_index = payload = 0
+            for offset, timestamp, _, length in self._scan(FILE_HEADER.size):
+                if offset >= next_index:
+                    entries.append((timestamp, payload, offset))
+                    next_index = offset + INDEX_INTERVAL
+                payload += length
+
+        self.index_timestamps = [e[0] for e in entries]
+        self.index_payload = [e[1] for e in entries]
+        self.index_offsets = [e[2] for e in entries]
+
+    def _scan(self, offset):
+        mm = self._mm
+        end = self.end
+
+        while offset + RECORD_HEADER.size <= end:
+            timestamp, direction, length = RECORD_HEADER.unpack_from(
+                mm, offset)
+            if (direction == DIRECTION_INDEX or
+                    offset + RECORD_HEADER.size + length > end):
+                break
+            yield offset, timestamp, direction, length
+            offset += RECORD_HEADER.size + length
+
+    @property
+    def empty(self):
+        # true for a capture that only has a header, or was cut off in the
+        # first record
+        return next(self._scan(FILE_HEADER.size), None) is None
+
+    def wall_time(self, timestamp):
+        return (self.start_wall + timestamp - self.start_monotonic) / 1e9
+
+    def records(self, offset=None, max_bytes=None):
+        if offset is None:
+            offset = FILE_HEADER.size
+
+        total = 0
+        for pos, timestamp, direction, length in self._scan(offset):
+            if max_bytes is not None and total >= max_bytes:
+                break
+
+            start = pos + RECORD_HEADER.size
+            yield (timestamp, DIRECTIONS[direction],
+                   self._mm[start:start + length])
+            total += length
+
+    def window(self, offset=None, max_bytes=INDEX_INTERVAL):
+        if offset is None:
+            offset = FILE_HEADER.size
+
+        records = []
+        total = 0
+        for pos, timestamp, direction, length in self._scan(offset):
+            if total >= max_bytes:
+                return records, pos
+
+            start = pos + RECORD_HEADER.size
+            records.append((timestamp, DIRECTIONS[direction],
+                            self._mm[start:start + length]))
+            total += length
+
+        return records, self.end
+
+    def _seek(self, keys, value, field):
+        # start from the closest indexed record, then walk forward
+        i = bisect_right(keys, value) - 1
+        if i < 0:
+            return FILE_HEADER.size
+
+        offset = self.index_offsets[i]
+        payload = self.index_payload[i]
+        for pos, timestamp, _, length in self._scan(offset):
+            if field == 'time' and timestamp >= value:
+                return pos
+            if field == 'bytes' and payload + length > value:
+                return pos
+            payload += length
+
+        return self.end
+
+    def seek_time(self, timestamp):
+        return self._seek(self.index_timestamps, timestamp, 'time')
+
+    def seek_bytes(self, n):
+        return self._seek(self.index_payload, n, 'bytes')
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def capture_serial(ser, writer, stop, max_chunk=65536, coalesce=0.0):
+    try:
+        while not stop.is_set():
+            data = read_chunk(ser, max_chunk, coalesce)
+            if data:
+                writer.write(data, 'in', time.monotonic_ns())
+    finally:
+        writer.close()
@@ -1,17 +1,21 @@
+import functools
+import glob
+import os
 import sys
-from itertools import product
 import json
-import re
+import threading
 import time
-from xml.etree import ElementTree as ET
 
 import click
 import serial
-from .io import Echo, RandomDataGenerator, SerialIO
-from .gui import run_gui
-from .util import parse_8bit, decode_8bit
-
-PARITIES = ['none', 'even', 'odd', 'mark', 'space']
+from .bounded import POLICIES
+from .capture import CaptureReader, CaptureWriter, capture_serial
+from .framing import parse_framer
+from .load import PAYLOADS, make_source, parse_distribution
+from .scan import PARITIES, candidates, format_settings, scan
+from .script import ScriptRunner, compile_script
+from .sequences import SequenceLibrary, import_hts
+from .util import parse_8bit, read_chunk
 
 
 @click.group()
@@ -19,153 +23,593 @@ def cli():
     pass
 
 
-@cli.command(help='Open pseudo-device that echos back info')
-def echo():
-    run_gui(Echo.new_and_start())
+def fps_option(f):
+    return click.option('--fps', type=click.IntRange(1), default=30,
+                        help='Maximum number of GUI updates per second')(f)
 
 
-@cli.command(help='Open pseudo-device producing random bytes')
-@click.option('--delay', '-d', type=float, default=0.5)
-def random(delay):
-    run_gui(RandomDataGenerator.new_and_start(delay))
+def framing_option(f):
+    def callback(ctx, param, value):
+        if value is None:
+            return None
+        try:
+            return parse_framer(value)
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+
+    return click.option('--framing', '-F', callback=callback,
+                        help='Split received data into frames and show them '
+                        'one per row: line[:DELIMITER], slip, cobs, '
+                        'length[:1|2|4[:le|be]] or idle[:SECONDS]')(f)
+
+
+def stats_option(f):
+    return click.option('--stats-interval', type=float,
+                        help='Print I/O statistics as JSON lines every this '
+                        'many seconds')(f)
+
+
+def buffer_options(f):
+    # collected into a single qargs dict for BackgroundIO
+    @functools.wraps(f)
+    def wrapper(buffer_bytes, overflow, send_buffer_bytes, send_overflow,
+                **kwargs):
+        qargs = {'pending_policy': overflow, 'send_policy': send_overflow}
+        if buffer_bytes is not None:
+            qargs['max_pending'] = buffer_bytes
+        if send_buffer_bytes is not None:
+            qargs['max_send'] = send_buffer_bytes
+
+        return f(qargs=qargs, **kwargs)
+
+    policies = click.Choice(POLICIES)
+    wrapper = click.option('--send-overflow', type=policies, default='block',
+                           help='What to do once the send buffer is full')(
+                               wrapper)
+    wrapper = click.option('--send-buffer-bytes', type=int,
+                           help='Bytes queued for sending at most')(wrapper)
+    wrapper = click.option('--overflow', type=policies, default='drop-oldest',
+                           help='What to do once data arrives faster than it '
+                           'can be shown')(wrapper)
+    wrapper = click.option('--buffer-bytes', type=int,
+                           help='Bytes buffered between the device and the '
+                           'GUI at most')(wrapper)
+    return wrapper
+
+
+def scrollback_options(f):
+    f = click.option('--spill/--no-spill', default=False,
+                     help='Keep trimmed data in a temporary file')(f)
+    f = click.option('--scrollback-lines', type=int,
+                     help='Trim views beyond this many lines')(f)
+    f = click.option('--scrollback-bytes', type=int,
+                     help='Trim views beyond this many bytes')(f)
+    return f
 
 
-@cli.command('open', help='Show GUI on given serial device')
-@click.argument('dev', type=click.Path(exists=True, dir_okay=False))
-@click.option('--baudrate', '-b', type=int)
-@click.option('--bytesize', '-B', type=int)
-@click.option('--parity', '-p', type=click.Choice(PARITIES))
-@click.option('--stopbits', '-s', type=click.Choice(['1', '1.5', '2']))
-@click.option('--xonxoff', is_flag=True, default=False)
-@click.option('--rts', is_flag=True, default=False)
-@click.option('--dsr', is_flag=True, default=False)
+@cli.command(help='Open pseudo-device that echos back info')
+@fps_option
+@stats_option
+@buffer_options
+@scrollback_options
+def echo(fps, stats_interval, qargs, scrollback_bytes, scrollback_lines,
+         spill):
+    from .gui import glib_timer, run_gui
+    from .io import Echo
+
+    run_gui(Echo.new_and_start(fps=fps, timer=glib_timer, **qargs),
+            stats_interval=stats_interval,
+            scrollback_bytes=scrollback_bytes,
+            scrollback_lines=scrollback_lines,
+            spill=spill)
+
+
+@cli.command(help='Open pseudo-device generating traffic, random bytes '
+             'by default')
+@click.option('--rate', '-r', type=int,
+              help='Bytes per second to generate, 0 for as fast as possible')
+@click.option('--delay', '-d', type=float, default=0.5,
+              help='Seconds between chunks, unless --rate is given')
+@click.option('--chunk-size', '-c', default='2',
+              help='Bytes per chunk: N, MIN-MAX or exp:MEAN')
+@click.option('--payload', '-p', type=click.Choice(PAYLOADS),
+              default='random')
+@click.option('--template', '-t', type=click.Path(exists=True,
+                                                  dir_okay=False),
+              help='File repeated by the file payload')
+@click.option('--direction', type=click.Choice(['in', 'out', 'both']),
+              default='in', help='Show generated data as received or sent')
+@framing_option
+@fps_option
+@stats_option
+@buffer_options
+@scrollback_options
+def random(rate, delay, chunk_size, payload, template, direction, framing,
+           fps, stats_interval, qargs, scrollback_bytes, scrollback_lines,
+           spill):
+    from .gui import glib_timer, run_gui
+    from .io import LoadGenerator
+
+    if payload == 'file' and template is None:
+        raise click.BadParameter('the file payload needs a --template')
+
+    try:
+        sizes = parse_distribution(chunk_size)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--chunk-size')
+
+    # framed payloads are decoded again, so the frame view shows them
+    framer = framing() if framing else None
+    source = make_source(payload, framing() if framing else None, template)
+
+    run_gui(LoadGenerator.new_and_start(source, sizes, rate, delay,
+                                        direction, fps=fps, timer=glib_timer,
+                                        framer=framer, **qargs),
+            stats_interval=stats_interval,
+            scrollback_bytes=scrollback_bytes,
+            scrollback_lines=scrollback_lines,
+            spill=spill)
+
+
+def serial_options(f):
+    @functools.wraps(f)
+    def wrapper(baudrate, bytesize, parity, stopbits, xonxoff, rts, dsr,
+                **kwargs):
+        sargs = {}
+
+        if baudrate is not None:
+            sargs['baudrate'] = baudrate
+
+        if bytesize is not None:
+            sargs['bytesize'] = bytesize
+
+        if parity:
+            sargs['parity'] = getattr(serial, 'PARITY_' + parity.upper())
+
+        if stopbits:
+            sargs['stopbits'] = {
+                '1': serial.STOPBITS_ONE,
+                '1.5': serial.STOPBITS_ONE_POINT_FIVE,
+                '2': serial.STOPBITS_TWO
+            }[stopbits]
+
+        sargs['rtscts'] = rts
+        sargs['dsrdtr'] = dsr
+        sargs['xonxoff'] = xonxoff
+
+        return f(sargs=sargs, **kwargs)
+
+    wrapper = click.option('--dsr', is_flag=True, default=False)(wrapper)
+    wrapper = click.option('--rts', is_flag=True, default=False)(wrapper)
+    wrapper = click.option('--xonxoff', is_flag=True, default=False)(wrapper)
+    wrapper = click.option('--stopbits', '-s',
+                           type=click.Choice(['1', '1.5', '2']))(wrapper)
+    wrapper = click.option('--parity', '-p',
+                           type=click.Choice(PARITIES))(wrapper)
+    wrapper = click.option('--bytesize', '-B', type=int)(wrapper)
+    wrapper = click.option('--baudrate', '-b', type=int)(wrapper)
+    return wrapper
+
+
+def chunk_options(f):
+    f = click.option('--coalesce', type=float, default=0.0,
+                     help='Seconds to wait for more data after the first '
+                     'byte')(f)
+    f = click.option('--chunk-size', type=int, default=65536,
+                     help='Maximum number of bytes delivered per read')(f)
+    return f
+
+
+def send_options(f):
+    f = click.option('--send-rate', type=int,
+                     help='Limit sending to this many bytes per second')(f)
+    f = click.option('--send-delay', type=float, default=0.0,
+                     help='Seconds to pause after each write')(f)
+    f = click.option('--send-chunk', type=int,
+                     help='Write at most this many bytes at once, 1 to pace '
+                     'individual bytes')(f)
+    return f
+
+
+@cli.command('open', help='Show GUI on given serial devices')
+@click.argument('devs', nargs=-1, required=True,
+                type=click.Path(exists=True, dir_okay=False))
+@serial_options
 @click.option('--seq', '-S', multiple=True, type=click.File())
-def open_serial_device(dev, baudrate, bytesize, parity, stopbits, rts, dsr,
-                       xonxoff, seq):
-    sargs = {'port': dev}
-
-    if baudrate is not None:
-        sargs['baudrate'] = baudrate
-
-    if bytesize is not None:
-        sargs['bytesize'] = bytesize
-
-    if parity:
-        sargs['parity'] = getattr(serial, 'PARITY_' + parity.upper())
-
-    if stopbits:
-        sargs['stopbits'] = {
-            '1': serial.STOPBITS_ONE,
-            '1.5': serial.STOPBITS_ONE_POINT_FIVE,
-            '2': serial.STOPBITS_TWO
-        }[stopbits]
-
-    sargs['rtscts'] = rts
-    sargs['dsrdtr'] = dsr
-    sargs['xonxoff'] = xonxoff
-
-    ser = serial.Serial(**sargs)
-    assert ser.isOpen()
-    click.echo(ser)
-
-    seqs = [json.load(s) for s in seq]
+@chunk_options
+@click.option('--backend', type=click.Choice(['thread', 'poll']),
+              help='Use two threads per device or poll all devices from a '
+              'single thread (default: poll for several devices)')
+@framing_option
+@send_options
+@fps_option
+@stats_option
+@buffer_options
+@scrollback_options
+def open_serial_device(devs, sargs, seq, chunk_size, coalesce, backend,
+                       framing, send_chunk, send_delay, send_rate, fps,
+                       stats_interval, qargs, scrollback_bytes,
+                       scrollback_lines, spill):
+    from .gui import glib_timer, run_gui
+    from .io import PolledSerialIO, SerialIO
+
+    # the poll backend neither paces nor coalesces
+    threaded = send_chunk or send_delay or send_rate or coalesce
+    if backend is None:
+        backend = 'poll' if len(devs) > 1 and not threaded else 'thread'
+    elif backend == 'poll' and threaded:
+        raise click.UsageError('--send-chunk, --send-delay, --send-rate and '
+                               '--coalesce need --backend thread')
+
+    ios = []
+    for dev in devs:
+        ser = serial.Serial(dev, **sargs)
+        assert ser.isOpen()
+        click.echo(ser)
+
+        # framers keep state, every device gets its own
+        framer = framing() if framing else None
+
+        if backend == 'poll':
+            ios.append(PolledSerialIO.new_and_start(ser, chunk_size,
+                                                    fps=fps,
+                                                    timer=glib_timer,
+                                                    framer=framer, **qargs))
+        else:
+            ios.append(SerialIO.new_and_start(ser, chunk_size, coalesce,
+                                              send_chunk, send_delay,
+                                              send_rate, fps=fps,
+                                              timer=glib_timer,
+                                              framer=framer, **qargs))
+
+    seqs = [SequenceLibrary.load(s) for s in seq]
+
+    run_gui(ios, seqs,
+            stats_interval=stats_interval,
+            scrollback_bytes=scrollback_bytes,
+            scrollback_lines=scrollback_lines,
+            spill=spill)
+
+
+@cli.command(help='Record serial devices to binary capture files, '
+             'without a GUI')
+@click.argument('devs', nargs=-1, required=True,
+                type=click.Path(exists=True, dir_okay=False))
+@serial_options
+@chunk_options
+@click.option('--output', '-o', default='{name}.pfcap',
+              help='Output file name, {name} is replaced by the device name')
+@click.option('--max-size', type=int,
+              help='Start a new file once this many bytes are written')
+def capture(devs, sargs, chunk_size, coalesce, output, max_size):
+    paths = [output.format(name=os.path.basename(dev)) for dev in devs]
+    if len(set(paths)) < len(paths):
+        raise click.UsageError('Every device needs its own output file, use '
+                               '{name} in --output')
+
+    sers = [serial.Serial(dev, timeout=0.1, **sargs) for dev in devs]
+    writers = [CaptureWriter(path, max_size) for path in paths]
+    stop = threading.Event()
+
+    threads = []
+    for ser, writer in zip(sers, writers):
+        click.echo('Capturing {} to {}'.format(ser.port, writer.path))
+        t = threading.Thread(target=capture_serial,
+                             args=(ser, writer, stop, chunk_size, coalesce))
+        t.start()
+        threads.append(t)
+
+    try:
+        while any(t.is_alive() for t in threads):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+
+    for writer in writers:
+        click.echo('{}: {} bytes in {} file(s)'.format(
+            writer.path, writer.total_bytes, writer.file_count))
+
+
+@cli.command('script', help='Run a sequence script against a serial device')
+@click.argument('dev', type=click.Path(exists=True, dir_okay=False))
+@click.argument('seqfile', type=click.File())
+@click.argument('name', required=False)
+@serial_options
+@click.option('--output', '-o', type=click.File('w'),
+              help='Write every response as a line of JSON')
+def run_script(dev, seqfile, name, sargs, output):
+    library = SequenceLibrary.load(seqfile)
+    scripts = library.scripts
+
+    if name is None:
+        if len(scripts) != 1:
+            raise click.UsageError('Choose a script: {}'.format(
+                ', '.join(sorted(scripts))))
+        name = next(iter(scripts))
+    elif name not in scripts:
+        raise click.UsageError('No script named {!r}'.format(name))
+
+    steps = compile_script(scripts[name], library.index)
+
+    def on_result(result):
+        if output:
+            output.write(json.dumps(result) + '\n')
+
+    ser = serial.Serial(dev, timeout=0.1, **sargs)
+    runner = ScriptRunner(steps, ser.write, on_result)
+    stop = threading.Event()
+
+    def receive():
+        while not stop.is_set():
+            data = read_chunk(ser)
+            if data:
+                runner.feed(data)
+
+    t = threading.Thread(target=receive)
+    t.start()
+
+    try:
+        summary = runner.run()
+    except KeyboardInterrupt:
+        runner.stop()
+        summary = runner.summary()
+    finally:
+        stop.set()
+        t.join()
+
+    click.echo(json.dumps(summary, indent=2))
+
+
+@cli.command(help='Measure request/response latency of a serial device')
+@click.argument('dev', required=False,
+                type=click.Path(exists=True, dir_okay=False))
+@serial_options
+@click.option('--send', type=parse_8bit, default='ping\\n',
+              help='Request to send')
+@click.option('--expect', '-e', type=parse_8bit, multiple=True,
+              help='Pattern ending a response (default: \\n)')
+@click.option('--count', '-c', type=int, default=10)
+@click.option('--interval', '-i', type=float, default=0.1,
+              help='Seconds between requests, 0 for as fast as possible')
+@click.option('--pipeline', '-P', type=click.IntRange(1), default=1,
+              help='Number of requests awaiting a response at once')
+@click.option('--timeout', '-W', type=float, default=1.0)
+@click.option('--echo', is_flag=True, default=False,
+              help='Ping the echo pseudo-device instead of DEV')
+@chunk_options
+@click.option('--backend', type=click.Choice(['thread', 'poll']),
+              default='thread')
+@click.option('--quiet', '-q', is_flag=True, default=False,
+              help='Only show the summary')
+@click.option('--json', 'as_json', is_flag=True, default=False,
+              help='Write the summary as JSON')
+def ping(dev, sargs, send, expect, count, interval, pipeline, timeout, echo,
+         chunk_size, coalesce, backend, quiet, as_json):
+    from .io import Echo, PolledSerialIO, SerialIO
+    from .ping import Pinger
+
+    if backend == 'poll' and coalesce:
+        raise click.UsageError('--coalesce needs --backend thread')
+
+    if echo:
+        io = Echo.new_and_start()
+        name = 'echo'
+    elif dev is None:
+        raise click.UsageError('Give a device or use --echo')
+    else:
+        ser = serial.Serial(dev, **sargs)
+        name = ser.port
+        if backend == 'poll':
+            io = PolledSerialIO.new_and_start(ser, chunk_size)
+        else:
+            io = SerialIO.new_and_start(ser, chunk_size, coalesce)
 
-    run_gui(SerialIO.new_and_start(ser), seqs)
+    def on_result(req):
+        if quiet:
+            return
+        if req.received is None:
+            click.echo('seq={} timeout'.format(req.seq), err=as_json)
+        else:
+            click.echo('seq={} time={:.3f} ms'.format(
+                req.seq, req.latency / 1e6), err=as_json)
+
+    pinger = Pinger(io, send, expect or [b'\n'], count, interval, pipeline,
+                    timeout, on_result)
+
+    click.echo('PING {} {} bytes, pipeline {}'.format(name, len(send),
+                                                      pipeline), err=as_json)
+
+    try:
+        summary = pinger.run()
+    except KeyboardInterrupt:
+        summary = pinger.summary()
+
+    if as_json:
+        click.echo(json.dumps(summary, indent=2))
+        return
+
+    click.echo('{sent} sent, {responses} responses, {timeouts} timeouts, '
+               '{unexpected} unexpected'.format(**summary))
+
+    if summary['responses']:
+        click.echo('min/avg/p50/p99/max = {} ms'.format('/'.join(
+            '{:.3f}'.format(summary[k] * 1000)
+            for k in ('min', 'avg', 'p50', 'p99', 'max'))))
+
+        peak = max(n for _, n in summary['histogram'])
+        for upper, n in summary['histogram']:
+            click.echo('{:>10.3f} ms  {:6d} {}'.format(
+                upper * 1000, n, '#' * max(1, 40 * n // peak)))
+
+
+def open_capture(path):
+    try:
+        return CaptureReader(path)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='CAPFILE')
+
+
+@cli.command(help='Play back a capture file as a pseudo-device')
+@click.argument('capfile', type=click.Path(exists=True, dir_okay=False))
+@click.option('--speed', '-x', type=float, default=1.0,
+              help='Playback speed multiplier, 0 for as fast as possible')
+@click.option('--loop', is_flag=True, default=False,
+              help='Start over once the end is reached')
+@fps_option
+@stats_option
+@buffer_options
+@scrollback_options
+def replay(capfile, speed, loop, fps, stats_interval, qargs,
+           scrollback_bytes, scrollback_lines, spill):
+    from .gui import glib_timer, run_gui
+    from .io import ReplayIO
+
+    with open_capture(capfile) as reader:
+        run_gui(ReplayIO.new_and_start(reader, speed, loop, fps=fps,
+                                       timer=glib_timer, **qargs),
+                stats_interval=stats_interval,
+                scrollback_bytes=scrollback_bytes,
+                scrollback_lines=scrollback_lines,
+                spill=spill)
+
+
+@cli.command(help='Browse a capture file')
+@click.argument('capfile', type=click.Path(exists=True, dir_okay=False))
+@click.option('--window', '-w', type=int, default=256 * 1024,
+              help='Bytes to load each time the end of the view is reached')
+@scrollback_options
+def view(capfile, window, scrollback_bytes, scrollback_lines, spill):
+    from .gui import run_viewer
+
+    with open_capture(capfile) as reader:
+        run_viewer(reader, window,
+                   scrollback_bytes=scrollback_bytes,
+                   scrollback_lines=scrollback_lines,
+                   spill=spill)
+
+
+def expand_devices(patterns):
+    devs = []
+
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise click.BadParameter('No such device: {}'.format(pattern))
+        devs.extend(m for m in matches if m not in devs)
+
+    return devs
+
+
+def print_ranking(results, top):
+    click.echo('\n{:>3} {:<22} {:>5} {:>6} {:>5} {:>5} {:>6} {:>5}'.format(
+        '#', 'settings', 'bytes', 'print', 'entr', 'lines', 'errors',
+        'score'))
+    for i, r in enumerate(results[:top], 1):
+        # there are no signals if nothing was received
+        sig = [r['signals'].get(k) for k in ('printable', 'entropy', 'lines')]
+        sig = ['-' if v is None else '{:.2f}'.format(v) for v in sig]
+        click.echo(
+            '{:>3} {:<22} {:>5} {:>6} {:>5} {:>5} {:>6} {:>5.2f}'
+            .format(i, format_settings(r['settings']), r['bytes'], *sig,
+                    '-' if r['errors'] is None else r['errors'], r['score']))
 
 
 @cli.command('try', help='Try multiple configurations, waiting for data')
-@click.argument('dev', type=click.Path(exists=True, dir_okay=False))
+@click.argument('devs', nargs=-1, required=True)
 @click.option('--send', '-s', type=parse_8bit)
-@click.option('--expect', '-e', type=parse_8bit)
+@click.option('--expect', '-e', type=parse_8bit, multiple=True,
+              help='Accept a configuration once this is received')
 @click.option('--timeout', '-t', type=float, default=0.25)
 @click.option('--delay', '-d', type=float, default=0.25)
-def find_settings(dev, send, expect, timeout, delay):
-    params = ([9600,
-               14400,
-               19200,
-               28800,
-               38400,
-               56000,
-               57600,
-               115200,
-               128000,
-               153600,
-               230400,
-               256000, ],
-              [8],
-              PARITIES,
-              [serial.STOPBITS_ONE, serial.STOPBITS_ONE_POINT_FIVE,
-               serial.STOPBITS_TWO],
-              (False, True),
-              (False, True),
-              (False, True), )
-    cs = product(*params)
-    for baudrate, bytesize, parity, stopbits, xonxoff, rts, dsr in cs:
-        sargs = {
-            'port': dev,
-            'baudrate': baudrate,
-            'bytesize': bytesize,
-            'parity': getattr(serial, 'PARITY_' + parity.upper()),
-            'stopbits': stopbits,
-            'xonxoff': xonxoff,
-            'rtscts': rts,
-            'dsrdtr': dsr,
-            'timeout': timeout,
-        }
+@click.option('--sample-size', type=click.IntRange(1), default=64,
+              help='Bytes to collect per configuration')
+@click.option('--accept', type=float, default=0.9,
+              help='Stop at the first configuration scoring at least this')
+@click.option('--all', 'scan_all', is_flag=True, default=False,
+              help='Score every configuration instead of stopping early')
+@click.option('--top', type=int, default=10,
+              help='Number of ranked configurations to show')
+@click.option('--stopbits/--no-stopbits', 'scan_stopbits', default=None,
+              help='Also vary stop bits (default: only with --send)')
+@click.option('--flow', is_flag=True, default=False,
+              help='Also vary flow control settings')
+@click.option('--jobs', '-j', type=click.IntRange(1), default=8,
+              help='Number of devices to probe concurrently')
+@click.option('--json', 'as_json', is_flag=True, default=False,
+              help='Print a JSON summary (default with several devices)')
+def find_settings(devs, send, expect, timeout, delay, sample_size, accept,
+                  scan_all, top, scan_stopbits, flow, jobs, as_json):
+    if scan_stopbits is None:
+        scan_stopbits = send is not None
+
+    devs = expand_devices(devs)
+    as_json = as_json or len(devs) > 1
+
+    def report(dev, result):
+        if result['failure']:
+            click.echo('{} [{}]: ignoring exception {}'.format(
+                dev, format_settings(result['settings']), result['failure']),
+                       err=as_json)
+        else:
+            click.echo('{} [{}]: {} bytes, score {:.2f}'.format(
+                dev, format_settings(result['settings']), result['bytes'],
+                result['score']), err=as_json)
 
+    def try_device(dev):
         try:
-            ser = serial.Serial(**sargs)
-        except Exception as e:
-            click.echo('Ignoring exception {}'.format(e))
-
-        if send is not None:
-            click.echo('Sending {!r}...'.format(send), nl=False)
-            assert len(send) == ser.write(send)
-            click.echo('OK')
-
-        if not expect:
-            click.echo('Waiting for any response from {} [{} baud]...'.format(
-                dev, baudrate),
-                       nl=False)
-            resp = ser.read()
-
-            if not resp:
-                click.echo('timeout')
-            else:
-                click.echo('OK')
-                break
-        else:
-            raise NotImplementedError()
-    else:
-        click.echo('No settings matched')
-        sys.exit(2)
+            with serial.Serial(dev, timeout=timeout,
+                               inter_byte_timeout=timeout / 10) as ser:
+                results = scan(ser, candidates(scan_stopbits, flow), send,
+                               sample_size, None if scan_all else accept,
+                               functools.partial(report, dev), expect)
+        except serial.SerialException as e:
+            click.echo('{}: {}'.format(dev, e), err=as_json)
+            return []
+
+        if expect:
+            return [r for r in results if r['matched']]
+        return [r for r in results if r['bytes']]
+
+    # imported here, it pulls in logging and is only needed for this command
+    from concurrent.futures import ThreadPoolExecutor
+
+    # each port only waits on its own device, so a rack takes about as long
+    # as its slowest port
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        ranked = dict(zip(devs, pool.map(try_device, devs)))
 
     time.sleep(delay)
 
-    click.echo('Settings:\n{}'.format(sargs))
+    summary = {}
+    for dev in devs:
+        results = ranked[dev]
+        if not results:
+            summary[dev] = None
+            if not as_json:
+                click.echo('No settings matched')
+            continue
 
+        best = results[0]
+        summary[dev] = dict(best['settings'], port=dev, score=best['score'])
 
-@cli.command('convert-hts', help='Read .hts file')
-@click.argument('htsfile', type=click.File())
-def convert_hts(htsfile):
-    BYTE_REGEX = re.compile(r'h\[([A-Za-z0-9]{2})\]$')
-
-    root = ET.parse(htsfile).getroot()
-    items = []
-
-    for item in root.iter('SequenceItem'):
-        name = item.attrib['name']
+        if not as_json:
+            print_ranking(results, top)
+            sargs = dict(best['settings'], port=dev)
+            click.echo('\nSettings (score {:.2f}):\n{}'.format(
+                best['score'], sargs))
 
-        seq = item.find('sequence').attrib['value'].split(' ')
-        val = []
-        for byte in seq:
-            m = BYTE_REGEX.match(byte)
-            if not m:
-                raise ValueError('Cannot parse {!r}'.format(byte))
+    if as_json:
+        click.echo(json.dumps(summary, indent=2))
 
-            val.append(int(m.group(1), 16))
+    if not any(summary.values()):
+        sys.exit(2)
 
-        items.append((name, decode_8bit(bytes(val))))
 
-    # FIXME: ini format probably better, can save one per device
-    click.echo(json.dumps(items, indent=2))
+@cli.command('convert-hts', help='Read .hts file')
+@click.argument('htsfile', type=click.File('rb'))
+def convert_hts(htsfile):
+    click.echo(json.dumps(import_hts(htsfile).to_json(), indent=2))
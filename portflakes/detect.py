@@ -0,0 +1,66 @@
+import fcntl
+import math
+import struct
+from collections import Counter
+
+PRINTABLE = bytes(range(0x20, 0x7f)) + b'\t\r\n'
+
+# struct serial_icounter_struct from linux/serial.h
+TIOCGICOUNT = 0x545d
+ICOUNT = struct.Struct('20i')
+ICOUNT_FIELDS = ('cts', 'dsr', 'rng', 'dcd', 'rx', 'tx', 'frame', 'overrun',
+                 'parity', 'brk', 'buf_overrun')
+
+WEIGHTS = {
+    'printable': 0.4,
+    'entropy': 0.2,
+    'lines': 0.15,
+    'errors': 0.25,
+}
+
+
+def error_counters(ser):
+    # only some drivers (mostly real UARTs and USB adapters) support this
+    try:
+        buf = fcntl.ioctl(ser.fileno(), TIOCGICOUNT, bytes(ICOUNT.size))
+    except (OSError, AttributeError, ValueError):
+        return None
+
+    counts = dict(zip(ICOUNT_FIELDS, ICOUNT.unpack(buf)))
+    return counts['frame'] + counts['parity'] + counts['brk']
+
+
+def entropy(sample):
+    n = float(len(sample))
+    return -sum(c / n * math.log(c / n, 2) for c in Counter(sample).values())
+
+
+def signals(sample, errors=None):
+    n = len(sample)
+
+    # garbage from a wrong baud rate is close to uniformly distributed, so its
+    # entropy approaches the maximum possible for the sample size
+    max_entropy = math.log(min(n, 256), 2) if n > 1 else 1.0
+
+    relative = entropy(sample) / max_entropy
+
+    sig = {
+        'printable': 1.0 - len(sample.translate(None, PRINTABLE)) / float(n),
+        'entropy': min(1.0, max(0.0, (0.95 - relative) / 0.35)),
+        'lines': min(1.0, sample.count(b'\n') / 2.0),
+    }
+
+    if errors is not None:
+        sig['errors'] = max(0.0, 1.0 - errors / float(n))
+
+    return sig
+
+
+def score(sample, errors=None):
+    if not sample:
+        return 0.0, {}
+
+    sig = signals(sample, errors)
+    total = sum(WEIGHTS[k] for k in sig)
+
+    return sum(WEIGHTS[k] * v for k, v in sig.items()) / total, sig
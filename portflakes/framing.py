@@ -0,0 +1,266 @@
+import threading
+import time
+
+from .util import parse_8bit
+
+SLIP_END = b'\xc0'
+SLIP_ESC = b'\xdb'
+
+
+class Framer(object):
+    # Turns a byte stream into frames. feed() is called with every received
+    # chunk and returns the frames it completed; poll() is called
+    # periodically for framers that complete frames on timeouts.
+
+    def __init__(self, max_frame=65536):
+        self.max_frame = max_frame
+        self._buf = bytearray()
+
+        self.frames = 0
+        self.errors = 0
+        self.overflows = 0
+
+    def reset(self):
+        del self._buf[:]
+
+    def feed(self, data):
+        raise NotImplementedError()
+
+    def poll(self):
+        return []
+
+    def encode(self, frame):
+        # the inverse of feed(), used to generate framed traffic
+        raise NotImplementedError()
+
+    def _overflow(self):
+        # hand out oversized data as it is rather than buffering forever
+        if len(self._buf) <= self.max_frame:
+            return []
+
+        self.overflows += 1
+        frame = bytes(self._buf)
+        del self._buf[:]
+        return [frame]
+
+
+class DelimitedFramer(Framer):
+    def __init__(self, delimiter, keep_empty=False, *args, **kwargs):
+        super(DelimitedFramer, self).__init__(*args, **kwargs)
+        self.delimiter = delimiter
+        self.keep_empty = keep_empty
+
+    def decode(self, frame):
+        return frame
+
+    def feed(self, data):
+        # only the new data (and a possibly split delimiter) is searched
+        start = max(0, len(self._buf) - len(self.delimiter) + 1)
+        self._buf += data
+
+        if self._buf.find(self.delimiter, start) == -1:
+            return self._overflow()
+
+        parts = self._buf.split(self.delimiter)
+        self._buf = parts.pop()
+
+        frames = []
+        for part in parts:
+            if not part and not self.keep_empty:
+                continue
+
+            try:
+                frames.append(self.decode(bytes(part)))
+            except ValueError:
+                self.errors += 1
+
+        self.frames += len(frames)
+        return frames
+
+
+class LineFramer(DelimitedFramer):
+    def __init__(self, delimiter=b'\n', *args, **kwargs):
+        super(LineFramer, self).__init__(delimiter, True, *args, **kwargs)
+
+    def encode(self, frame):
+        return frame + self.delimiter
+
+
+class SLIPFramer(DelimitedFramer):
+    def __init__(self, *args, **kwargs):
+        super(SLIPFramer, self).__init__(SLIP_END, False, *args, **kwargs)
+
+    def decode(self, frame):
+        if SLIP_ESC not in frame:
+            return frame
+
+        # every escape byte must start one of the two escape sequences
+        if frame.count(SLIP_ESC) != (frame.count(b'\xdb\xdc') +
+                                     frame.count(b'\xdb\xdd')):
+            raise ValueError('Invalid SLIP escape')
+
+        return frame.replace(b'\xdb\xdc', SLIP_END).replace(b'\xdb\xdd',
+                                                            SLIP_ESC)
+
+    def encode(self, frame):
+        return SLIP_END + frame.replace(SLIP_ESC, b'\xdb\xdd').replace(
+            SLIP_END, b'\xdb\xdc') + SLIP_END
+
+
+class COBSFramer(DelimitedFramer):
+    def __init__(self, *args, **kwargs):
+        super(COBSFramer, self).__init__(b'\x00', False, *args, **kwargs)
+
+    def decode(self, frame):
+        # copies whole blocks, the loop runs once per code byte
+        out = bytearray()
+        i = 0
+        n = len(frame)
+
+        while i < n:
+            code = frame[i]
+            if not code or i + code > n:
+                raise ValueError('Invalid COBS block')
+
+            out += frame[i + 1:i + code]
+            i += code
+
+            if code < 0xff and i < n:
+                out.append(0)
+
+        return bytes(out)
+
+    def encode(self, frame):
+        out = bytearray()
+
+        for part in frame.split(b'\x00'):
+            while len(part) >= 0xfe:
+                out.append(0xff)
+                out += part[:0xfe]
+                part = part[0xfe:]
+
+            out.append(len(part) + 1)
+            out += part
+
+        out.append(0)
+        return bytes(out)
+
+
+class LengthPrefixFramer(Framer):
+    def __init__(self, size=2, byteorder='big', include_header=False, *args,
+                 **kwargs):
+        super(LengthPrefixFramer, self).__init__(*args, **kwargs)
+        self.size = size
+        self.byteorder = byteorder
+        self.include_header = include_header
+
+    def feed(self, data):
+        self._buf += data
+
+        frames = []
+        buf = self._buf
+        pos = 0
+
+        while len(buf) - pos >= self.size:
+            length = int.from_bytes(buf[pos:pos + self.size], self.byteorder)
+            end = pos + self.size + length
+
+            if length > self.max_frame:
+                # the stream is out of sync, nothing after this is trustworthy
+                self.errors += 1
+                pos = len(buf)
+                break
+
+            if end > len(buf):
+                break
+
+            frames.append(bytes(buf[pos if self.include_header else
+                                    pos + self.size:end]))
+            pos = end
+
+        del buf[:pos]
+
+        self.frames += len(frames)
+        return frames
+
+    def encode(self, frame):
+        return len(frame).to_bytes(self.size, self.byteorder) + frame
+
+
+class IdleGapFramer(Framer):
+    # A frame ends once the line has been idle for `gap` seconds. feed() runs
+    # on the receive thread and poll() on the delivery timer, hence the lock.
+
+    def __init__(self, gap=0.005, clock=time.monotonic, *args, **kwargs):
+        super(IdleGapFramer, self).__init__(*args, **kwargs)
+        self.gap = gap
+        self.clock = clock
+
+        self._last = 0.0
+        self._lock = threading.Lock()
+
+    def _take_idle(self, now):
+        if not self._buf or now - self._last < self.gap:
+            return []
+
+        frame = bytes(self._buf)
+        del self._buf[:]
+        self.frames += 1
+        return [frame]
+
+    def feed(self, data):
+        now = self.clock()
+
+        with self._lock:
+            frames = self._take_idle(now)
+            self._buf += data
+            self._last = now
+            return frames + self._overflow()
+
+    def poll(self):
+        with self._lock:
+            return self._take_idle(self.clock())
+
+    def encode(self, frame):
+        # the gap has to come from pacing
+        return frame
+
+
+FRAMERS = {
+    'line': LineFramer,
+    'slip': SLIPFramer,
+    'cobs': COBSFramer,
+    'length': LengthPrefixFramer,
+    'idle': IdleGapFramer,
+}
+
+
+def parse_framer(spec):
+    # line[:DELIMITER], slip, cobs, length[:SIZE[:le|be]], idle[:SECONDS]
+    name, _, args = spec.partition(':')
+
+    if name not in FRAMERS:
+        raise ValueError('Unknown framing {!r}, use one of {}'.format(
+            name, ', '.join(sorted(FRAMERS))))
+
+    if name == 'line' and args:
+        return lambda: LineFramer(parse_8bit(args))
+
+    if name == 'length' and args:
+        size, _, order = args.partition(':')
+        size = int(size)
+        if size not in (1, 2, 4):
+            raise ValueError('Length prefix must be 1, 2 or 4 bytes')
+        byteorder = {'': 'big', 'be': 'big', 'le': 'little'}.get(order)
+        if byteorder is None:
+            raise ValueError('Byte order must be le or be')
+        return lambda: LengthPrefixFramer(size, byteorder)
+
+    if name == 'idle' and args:
+        gap = float(args)
+        return lambda: IdleGapFramer(gap)
+
+    if args:
+        raise ValueError('{} framing takes no arguments'.format(name))
+
+    return FRAMERS[name]
@@ -1,10 +1,32 @@
-from gi.repository import Gtk, Pango, GObject, Gio, Gdk
-
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from itertools import islice
+
+from gi.repository import Gtk, Pango, GObject, Gio, Gdk, GLib
+
+from .history import ByteHistory
+from .match import PatternSet, Trigger
+from .script import ScriptRunner, compile_script
+from .sequences import SequenceLibrary
+from .stats import Histogram, HistogramReaders, format_stats
+from .store import ChunkStore
 from .util import parse_8bit
 
 
-def run_gui(io, seqs=[]):
-    mw = TermGUI(io=io)
+def glib_timer(interval, callback):
+    # delivers BackgroundIO signals on the main loop, where widgets live
+    GLib.timeout_add(interval, callback)
+
+
+def run_gui(io, seqs=[], stats_interval=None, **viewer_args):
+    ios = io if isinstance(io, (list, tuple)) else [io]
+    mw = TermGUI(ios=ios, viewer_args=viewer_args,
+                 stats_interval=stats_interval)
 
     for seq in seqs:
         mw.load_sequences(seq)
@@ -14,12 +36,26 @@ def run_gui(io, seqs=[]):
     Gtk.main()
 
 
+def run_viewer(reader, window, **viewer_args):
+    mw = CaptureWindow(reader, window, viewer_args=viewer_args)
+    mw.show()
+
+    Gtk.main()
+
+
 class TermGUI(Gtk.Window):
-    def __init__(self, io=None, *args, **kwargs):
+    # seconds between header bar statistics updates
+    STATS_REFRESH = 1.0
+
+    def __init__(self, ios=(), viewer_args={}, stats_interval=None, *args,
+                 **kwargs):
         super(TermGUI, self).__init__(*args, **kwargs)
 
         self.set_name('portflakes')
-        self.sequence_model = Gtk.ListStore(str, str)
+        # name, display text and precompiled bytes
+        self.sequence_model = Gtk.ListStore(str, str, object)
+        self.library = SequenceLibrary()
+        self.scripts = self.library.scripts
 
         # build gui
         root = Gtk.VBox()
@@ -28,7 +64,10 @@ class TermGUI(Gtk.Window):
         # header
         header = Gtk.HeaderBar()
         header.set_show_close_button(True)
-        header.props.title = 'portflakes: {}'.format(io.name)
+        if len(ios) == 1:
+            header.props.title = 'portflakes: {}'.format(ios[0].name)
+        else:
+            header.props.title = 'portflakes: {} devices'.format(len(ios))
 
         seq_button = Gtk.Button()
         seq_icon = Gio.ThemedIcon(name="folder")
@@ -36,21 +75,39 @@ class TermGUI(Gtk.Window):
         seq_button.add(seq_image)
         header.pack_end(seq_button)
 
+        self.stats_label = Gtk.Label()
+        header.pack_end(self.stats_label)
+
         root.pack_start(header, False, True, 0)
+        self.header = header
 
-        # ibox: displays input/output and entry
-        ibox = Gtk.VBox()
+        GLib.timeout_add(int(1000 * self.STATS_REFRESH), self._update_stats)
 
-        viewer = MultiFormatViewer()
-        entry = DataEntry()
+        # with an interval, statistics are also written to stdout as json
+        if stats_interval is not None:
+            GLib.timeout_add(int(1000 * stats_interval), self._dump_stats)
 
-        ibox.pack_start(viewer, True, True, 0)
-        ibox.pack_start(entry, False, True, 0)
+        # one pane per device, tabbed if there is more than one
+        self.panes = [
+            DevicePane(io, viewer_args, self.find_sequence) for io in ios
+        ]
+
+        if len(self.panes) == 1:
+            ibox = self.panes[0]
+            self.tabs = None
+        else:
+            ibox = self.tabs = Gtk.Notebook()
+            for pane in self.panes:
+                self.tabs.append_page(pane, Gtk.Label(pane.io.name))
 
         # sequence tree
-        ftree = SequenceTree(self.sequence_model)
+        ftree = SequenceTree(self.sequence_model, self.scripts)
         seq_button.connect(
             'clicked', lambda _: ftree.set_visible(not ftree.get_visible()))
+        ftree.connect('send-sequence',
+                      lambda _, d: self.active_pane.io.send_data(d))
+        ftree.connect('run-script',
+                      lambda _, name: self.run_script(name))
 
         # center box
         mbox = Gtk.Box()
@@ -60,29 +117,216 @@ class TermGUI(Gtk.Window):
 
         self.connect('delete-event', Gtk.main_quit)
 
+        self.show_all()
+        ftree.hide()
+
+    @property
+    def active_pane(self):
+        if self.tabs is None:
+            return self.panes[0]
+        return self.panes[self.tabs.get_current_page()]
+
+    def _update_stats(self):
+        # every pane is read, so switching tabs shows the last interval too
+        active = self.active_pane
+
+        for pane in self.panes:
+            stats = pane.get_stats('label')
+            if pane is active:
+                self.stats_label.set_text(format_stats(stats))
+
+        return True
+
+    def _dump_stats(self):
+        for pane in self.panes:
+            stats = pane.get_stats('dump')
+            stats['time'] = time.time()
+            sys.stdout.write(json.dumps(stats) + '\n')
+
+        sys.stdout.flush()
+        return True
+
+    def load_sequences(self, library):
+        for name, text, data in library:
+            self.library.add(name, text, data)
+            self.sequence_model.append([name, text, data])
+
+        for name, script in library.scripts.items():
+            self.scripts[name] = script
+            self.sequence_model.append(
+                [name, '<script, {} steps>'.format(len(script)), None])
+
+    def find_sequence(self, name):
+        return self.library.index.get(name)
+
+    def run_script(self, name):
+        self.active_pane.run_script(name, compile_script(
+            self.scripts[name], self.library.index))
+
+
+class DevicePane(Gtk.VBox):
+    def __init__(self, io, viewer_args={}, find_sequence=None, *args,
+                 **kwargs):
+        super(DevicePane, self).__init__(*args, **kwargs)
+
+        self.io = io
+        self.find_sequence = find_sequence
+
+        # displays input/output and entry
+        self.viewer = MultiFormatViewer(**viewer_args)
+        search = SearchBar(self.viewer)
+        patterns = PatternBar(self.viewer)
+        entry = DataEntry()
+
+        self.pack_start(self.viewer, True, True, 0)
+        self.pack_start(search, False, True, 0)
+        self.pack_start(patterns, False, True, 0)
+        self.pack_start(entry, False, True, 0)
+
         # connect to io
-        if io:
-            io.connect('data-received', lambda _, d: viewer.append(d, 'in'))
-            io.connect('data-sent', lambda _, d: viewer.append(d, 'out'))
-            ftree.connect('send-sequence', lambda _, d: io.send_data(d))
+        io.connect('data-received',
+                   lambda _, d: self.viewer.append(d, 'in'))
+        io.connect('data-sent', lambda _, d: self.viewer.append(d, 'out'))
+        io.connect('data-dropped',
+                   lambda _, d, n: self.viewer.append_gap(n, d))
+        entry.connect('data-entered', lambda _, d: io.send_data(d))
+
+        if io.framer is not None:
+            self.viewer.add_frame_view()
+            io.connect('frame-received',
+                       lambda _, f: self.viewer.append_frames(f, 'in'))
+
+        self.viewer.connect('pattern-matched', self._on_pattern_matched)
+
+        self.runner = None
+
+    def get_stats(self, reader=None):
+        stats = self.io.get_stats(reader)
+        stats.update(self.viewer.get_stats(reader))
+        stats['device'] = self.io.name
+        return stats
+
+    def run_script(self, name, steps):
+        if self.runner is not None:
+            self.runner.stop()
+
+        runner = ScriptRunner(steps, self.io.send_data)
+        self.runner = runner
+
+        # responses are matched on the io thread, so frame pacing does not
+        # add to the measured latency
+        def tap(signal, data):
+            if signal == 'data-received':
+                runner.feed(data)
+
+        def run():
+            self.io.add_tap(tap)
+            try:
+                summary = runner.run()
+            finally:
+                self.io.remove_tap(tap)
+            GLib.idle_add(self._on_script_done, name, summary)
+
+        t = threading.Thread(target=run)
+        t.daemon = True
+        t.start()
+
+    def _on_script_done(self, name, summary):
+        text = '{}: {} sent, {} responses, {} timeouts'.format(
+            name, summary['sent'], summary['responses'], summary['timeouts'])
+        if 'p99' in summary:
+            text += ', p50 {:.1f} ms, p99 {:.1f} ms'.format(
+                summary['p50'] * 1000, summary['p99'] * 1000)
+
+        self.get_toplevel().header.props.subtitle = text
+
+    def _on_pattern_matched(self, viewer, trigger, data):
+        if trigger.action == 'send' and self.find_sequence:
+            seq = self.find_sequence(trigger.sequence)
+            if seq is not None:
+                self.io.send_data(seq)
+
+
+class CaptureWindow(Gtk.Window):
+    def __init__(self, reader, window, viewer_args={}, *args, **kwargs):
+        super(CaptureWindow, self).__init__(*args, **kwargs)
+
+        self.set_name('portflakes')
+        self.reader = reader
+        self.window = window
+        self.offset = None
+
+        root = Gtk.VBox()
+        self.add(root)
+
+        header = Gtk.HeaderBar()
+        header.set_show_close_button(True)
+        header.props.title = 'portflakes: {}'.format(
+            os.path.basename(reader.path))
+
+        goto = Gtk.Entry()
+        goto.set_placeholder_text('byte offset or +seconds')
+        goto.connect('activate', self._on_goto_activate)
+        header.pack_end(goto)
+
+        root.pack_start(header, False, True, 0)
+
+        # new data is loaded once the end of the view is scrolled to, so the
+        # view must not follow the end by itself
+        self.viewer = MultiFormatViewer(auto_scroll=False, **viewer_args)
+        self.viewer.connect('end-reached', lambda _: self.load_more())
+        root.pack_start(self.viewer, True, True, 0)
 
-            entry.connect('data-entered', lambda _, d: io.send_data(d))
+        self.connect('delete-event', Gtk.main_quit)
 
         self.show_all()
-        ftree.hide()
+        self.load_more()
+
+    def load_more(self):
+        if self.offset == self.reader.end:
+            return
+
+        records, self.offset = self.reader.window(self.offset, self.window)
+        for timestamp, direction, data in records:
+            self.viewer.append(data, direction,
+                               self.reader.wall_time(timestamp))
+
+    def goto(self, offset):
+        self.viewer.clear()
+        self.offset = offset
+        self.load_more()
+
+    def _on_goto_activate(self, entry):
+        text = entry.get_text().strip()
+
+        try:
+            if text.startswith('+'):
+                ts = self.reader.start_monotonic + int(float(text) * 1e9)
+                offset = self.reader.seek_time(ts)
+            else:
+                offset = self.reader.seek_bytes(int(text, 0))
+        except ValueError as e:
+            dlg = Gtk.MessageDialog(self.get_toplevel(), Gtk.DialogFlags.MODAL,
+                                    Gtk.MessageType.ERROR, Gtk.ButtonsType.OK,
+                                    str(e))
+            dlg.run()
+            dlg.destroy()
+            return
 
-    def load_sequences(self, seqs):
-        for row in seqs:
-            self.sequence_model.append(row)
+        self.goto(offset)
 
 
 class SequenceTree(Gtk.VBox):
     __gsignals__ = {'send-sequence': (GObject.SIGNAL_RUN_FIRST, None,
-                                      (object, )), }
+                                      (object, )),
+                    'run-script': (GObject.SIGNAL_RUN_FIRST, None,
+                                   (object, )), }
 
-    def __init__(self, model, *args, **kwargs):
+    def __init__(self, model, scripts={}, *args, **kwargs):
         super(SequenceTree, self).__init__(*args, **kwargs)
 
+        self.scripts = scripts
+
         self.view = Gtk.TreeView(model)
         self.view.set_model(model)
         self.set_size_request(150, 0)
@@ -116,9 +360,15 @@ class SequenceTree(Gtk.VBox):
     def _on_send_button_clicked(self, _):
         sel = self.view.get_selection()
 
-        if sel:
-            seq = sel.get_selected_rows()[0][0][1]
-            self.emit('send-sequence', parse_8bit(seq))
+        model, it = sel.get_selected()
+
+        if it is not None:
+            name, data = model[it][0], model[it][2]
+
+            if data is None and name in self.scripts:
+                self.emit('run-script', name)
+            else:
+                self.emit('send-sequence', data)
 
 
 class CellRendererButton(Gtk.CellRenderer):
@@ -249,6 +499,18 @@ class DataView(Gtk.TextView):
         tb = self.get_buffer()
         self.tag_incoming = tb.create_tag('incoming', foreground='#aa3')
         self.tag_outgoing = tb.create_tag('outgoing', foreground='#88f')
+        self.tag_highlight = tb.create_tag('highlight', foreground='#f44',
+                                           weight=Pango.Weight.BOLD)
+        self.tag_mark = tb.create_tag('mark', foreground='#f4f',
+                                      underline=Pango.Underline.SINGLE)
+        self.tag_gap = tb.create_tag('gap', foreground='#000',
+                                     background='#f80')
+
+        # number of characters rendered for each chunk, the first of which
+        # has the store index self.first, and the render state at its start
+        self._chunk_chars = deque()
+        self._chunk_states = deque()
+        self.first = 0
 
     def _style(self):
         ctx = self.get_style_context()
@@ -268,56 +530,176 @@ class DataView(Gtk.TextView):
         self.modify_font(Pango.FontDescription('Monospace'))
         self.set_wrap_mode(Gtk.WrapMode.CHAR)
 
-    def append(self, data, direction):
+    @property
+    def end(self):
+        return self.first + len(self._chunk_chars)
+
+    def append(self, data, direction, highlights=()):
+        pos = self.get_buffer().get_end_iter()
+        start = pos.get_offset()
+        self._chunk_states.append(self.render_state())
+
+        self._render(pos, data, direction, highlights)
+        self._chunk_chars.append(pos.get_offset() - start)
+
+    def _render(self, pos, data, direction, highlights):
+        # highlights are (start, end, tag name) ranges within data
+        idx = 0
+        for hl_start, hl_end, tag in highlights:
+            hl_start = max(hl_start, idx)
+            if hl_start >= hl_end:
+                continue
+
+            self._insert(pos, data[idx:hl_start], direction)
+            self._insert(pos, data[hl_start:hl_end], direction,
+                         (getattr(self, 'tag_' + tag), ))
+            idx = hl_end
+        self._insert(pos, data[idx:], direction)
+
+    def render_state(self):
+        # whatever rendering of the next chunk depends on
+        return None
+
+    def text_length(self, data, state=None):
+        # characters _insert renders for data, starting in the given state
+        return len(repr(data))
+
+    def char_offset(self, index, data, offset):
+        # character offset of byte offset within chunk index, holding data
+        i = index - self.first
+        chars = sum(islice(self._chunk_chars, 0, i))
+
+        # where the byte at offset is rendered, after any line break added
+        # in front of it
+        rendered = (self.text_length(data[:offset + 1], self._chunk_states[i])
+                    - self.text_length(data[offset:offset + 1]))
+        return chars + min(rendered, self._chunk_chars[i])
+
+    def select(self, start, end):
         tb = self.get_buffer()
-        tb.insert_with_tags(tb.get_end_iter(), repr(data), self.tag_incoming if
-                            direction == 'in' else self.tag_outgoing)
+        it = tb.get_iter_at_offset(start)
+
+        tb.select_range(it, tb.get_iter_at_offset(end))
+        self.scroll_to_iter(it, 0.1, False, 0, 0)
+
+    def append_gap(self, n):
+        # data lost before it reached the view, rendered as a single chunk
+        pos = self.get_buffer().get_end_iter()
+        start = pos.get_offset()
+        self._chunk_states.append(self.render_state())
+
+        self._render_gap(pos, n)
+        self._chunk_chars.append(pos.get_offset() - start)
+
+    def _render_gap(self, pos, n):
+        self.get_buffer().insert_with_tags(
+            pos, ' [{} bytes dropped] '.format(n), self.tag_gap)
+
+    def prepend(self, chunks):
+        # chunks are (data, direction, bytes lost or None, highlights)
+        pos = self.get_buffer().get_start_iter()
+        sizes = []
+        states = []
+
+        for data, direction, gap, highlights in chunks:
+            start = pos.get_offset()
+            states.append(self.render_state())
+            if gap is None:
+                self._render(pos, data, direction, highlights)
+            else:
+                self._render_gap(pos, gap)
+            sizes.append(pos.get_offset() - start)
+
+        self._chunk_chars.extendleft(reversed(sizes))
+        self._chunk_states.extendleft(reversed(states))
+        self.first -= len(sizes)
+
+    def trim_head(self, n):
+        chars = sum(self._chunk_chars.popleft() for _ in range(n))
+        for _ in range(n):
+            self._chunk_states.popleft()
+        self.first += n
+
+        tb = self.get_buffer()
+        tb.delete(tb.get_start_iter(), tb.get_iter_at_offset(chars))
+
+    def _insert(self, pos, data, direction, extra_tags=()):
+        if not data:
+            return
+
+        self.get_buffer().insert_with_tags(
+            pos, repr(data), self.tag_incoming
+            if direction == 'in' else self.tag_outgoing, *extra_tags)
+
+
+# printable bytes, line terminators and everything else, each as a run
+RUN_REGEX = re.compile(rb'([\x20-\x7e]+)|([\r\n]+)|([^\x20-\x7e\r\n]+)')
+
+ESCAPES = [r'\x{:x}'.format(c) for c in range(256)]
+ESCAPES[0x09] = r'\t'
+ESCAPES[0x0a] = r'\n'
+ESCAPES[0x0d] = r'\r'
 
 
 class ASCIIView(DataView):
     def __init__(self, *args, **kwargs):
-        super(ASCIIView, self).__init__(*self, **kwargs)
+        super(ASCIIView, self).__init__(*args, **kwargs)
 
         # create tags
         tb = self.get_buffer()
         self.tag_non_ascii = tb.create_tag('non_ascii', background='#333')
         self.tag_nl = tb.create_tag('nl', background='#000')
 
-        self.map = {
-            0x09: (r'\t', self.tag_non_ascii),
-            0x0a: (r'\n', self.tag_nl),
-            0x0d: (r'\r', self.tag_nl),
-        }
-
         self.break_next = False
 
-    def append(self, data, direction):
+    def prepend(self, chunks):
+        # prepended data must not disturb line breaking at the end
+        break_next = self.break_next
+        self.break_next = False
+        super(ASCIIView, self).prepend(chunks)
+        self.break_next = break_next
+
+    def render_state(self):
+        return self.break_next
+
+    def text_length(self, data, state=False):
+        # state is break_next before data, as recorded when it was rendered
+        length = 0
+        for m in RUN_REGEX.finditer(data):
+            printable, newlines, other = m.groups()
+            length += len(printable) if printable else sum(
+                map(len, map(ESCAPES.__getitem__, newlines or other)))
+
+            # the line feed _insert adds
+            if state and not newlines:
+                length += 1
+            state = bool(newlines)
+        return length
+
+    def _insert(self, pos, data, direction, extra_tags=()):
         tb = self.get_buffer()
-        pos = tb.get_end_iter()
-
-        for c in data:
-            tags = [self.tag_incoming if direction == 'in' else
-                    self.tag_outgoing]
-
-            # printable range
-            if 32 <= c < 127:
-                buf = chr(c)
-            elif c in self.map:
-                fmt = self.map[c]
-                buf = fmt[0]
-                tags.extend(fmt[1:])
+        tag_dir = (self.tag_incoming if direction == 'in' else
+                   self.tag_outgoing)
+
+        for m in RUN_REGEX.finditer(data):
+            printable, newlines, other = m.groups()
+
+            if printable:
+                buf = printable.decode('ascii')
+                tags = (tag_dir, )
+            elif newlines:
+                buf = ''.join(map(ESCAPES.__getitem__, newlines))
+                tags = (tag_dir, self.tag_nl)
             else:
-                buf = r'\x{:x}'.format(c)
-                tags.append(self.tag_non_ascii)
+                buf = ''.join(map(ESCAPES.__getitem__, other))
+                tags = (tag_dir, self.tag_non_ascii)
 
             # add line feed on carriage return
-            if c in (0x0d, 0xa):
-                self.break_next = True
-            elif self.break_next:
+            if self.break_next and not newlines:
                 buf = '\n' + buf
-                self.break_next = False
+            self.break_next = bool(newlines)
 
-            tb.insert_with_tags(pos, buf, *tags)
+            tb.insert_with_tags(pos, buf, *(tags + extra_tags))
 
 
 class HexView(DataView):
@@ -332,13 +714,235 @@ class HexView(DataView):
         super(HexView, self)._style()
         self.set_wrap_mode(Gtk.WrapMode.WORD)
 
-    def append(self, data, direction):
+    def text_length(self, data, state=None):
+        return 3 * len(data)
+
+    def _insert(self, pos, data, direction, extra_tags=()):
+        if not data:
+            return
+
         tb = self.get_buffer()
-        pos = tb.get_end_iter()
+        tb.insert_with_tags(pos, data.hex(' ') + ' ',
+                            self.tag_incoming if direction == 'in' else
+                            self.tag_outgoing, *extra_tags)
+
+
+# escapes everything but printable ascii in a single str.translate
+FRAME_ESCAPES = {c: ESCAPES[c] for c in range(256) if not 0x20 <= c < 0x7f}
+
+
+class FrameView(DataView):
+    # one row per frame, prefixed with its length
+
+    def _insert(self, pos, data, direction, extra_tags=()):
+        text = data.decode('latin1').translate(FRAME_ESCAPES)
 
-        for c in data:
-            tb.insert_with_tags(pos, '{:02x} '.format(c), self.tag_incoming if
-                                direction == 'in' else self.tag_outgoing)
+        self.get_buffer().insert_with_tags(
+            pos, '{:6d}  {}\n'.format(len(data), text), self.tag_incoming
+            if direction == 'in' else self.tag_outgoing, *extra_tags)
+
+
+class SearchBar(Gtk.HBox):
+    MODES = ['escaped', 'hex', 'regex']
+    DIRECTIONS = [('both', None), ('received', 'in'), ('sent', 'out')]
+
+    def __init__(self, viewer, *args, **kwargs):
+        super(SearchBar, self).__init__(*args, **kwargs)
+
+        self.viewer = viewer
+
+        # start of the current hit, as (store index, offset)
+        self.cursor = None
+
+        self.pattern = Gtk.Entry()
+        self.pattern.set_placeholder_text('search received and sent bytes')
+        self.pattern.connect('activate', lambda _: self.search(False))
+        self.pattern.connect('changed', lambda _: self._reset())
+
+        self.mode = Gtk.ComboBoxText()
+        for label in self.MODES:
+            self.mode.append_text(label)
+        self.mode.set_active(0)
+        self.mode.connect('changed', lambda _: self._reset())
+
+        self.direction = Gtk.ComboBoxText()
+        for label, _ in self.DIRECTIONS:
+            self.direction.append_text(label)
+        self.direction.set_active(0)
+        self.direction.connect('changed', lambda _: self._reset())
+
+        prev = Gtk.Button('Previous')
+        prev.connect('clicked', lambda _: self.search(True))
+
+        nxt = Gtk.Button('Next')
+        nxt.connect('clicked', lambda _: self.search(False))
+
+        prev_mark = Gtk.Button('Previous mark')
+        prev_mark.connect('clicked', lambda _: self.jump_mark(True))
+
+        next_mark = Gtk.Button('Next mark')
+        next_mark.connect('clicked', lambda _: self.jump_mark(False))
+
+        self.status = Gtk.Label()
+
+        self.pack_start(self.pattern, True, True, 0)
+        self.pack_start(self.mode, False, True, 0)
+        self.pack_start(self.direction, False, True, 0)
+        self.pack_start(prev, False, True, 0)
+        self.pack_start(nxt, False, True, 0)
+        self.pack_start(prev_mark, False, True, 0)
+        self.pack_start(next_mark, False, True, 0)
+        self.pack_start(self.status, False, True, 0)
+
+    def _reset(self):
+        self.cursor = None
+        self.status.set_text('')
+
+    def _pattern(self):
+        text = self.pattern.get_text()
+        mode = self.MODES[self.mode.get_active()]
+
+        if mode == 'hex':
+            return bytes.fromhex(text)
+        if mode == 'regex':
+            pattern = text.encode('latin1')
+            re.compile(pattern)
+            return pattern
+        return parse_8bit(text)
+
+    def search(self, backwards):
+        if not self.pattern.get_text():
+            return
+
+        try:
+            pattern = self._pattern()
+        except Exception as e:
+            dlg = Gtk.MessageDialog(self.get_toplevel(), Gtk.DialogFlags.MODAL,
+                                    Gtk.MessageType.ERROR, Gtk.ButtonsType.OK,
+                                    str(e))
+            dlg.run()
+            dlg.destroy()
+            return
+
+        if self.cursor is None:
+            index, offset = (sys.maxsize, 0) if backwards else (-1, 0)
+        else:
+            index, offset = self.cursor
+            if not backwards:
+                offset += 1
+
+        hit = self.viewer.history.find(
+            pattern, index, offset,
+            self.DIRECTIONS[self.direction.get_active()][1],
+            self.MODES[self.mode.get_active()] == 'regex', backwards)
+
+        if hit is None:
+            self.status.set_text('no more matches')
+            return
+
+        direction, start, end = hit
+        self.cursor = start
+
+        if self.viewer.show_range(start, end):
+            self.status.set_text('{} at chunk {}'.format(direction, start[0]))
+        else:
+            self.status.set_text('match at chunk {} is no longer in '
+                                 'scrollback'.format(start[0]))
+
+    def jump_mark(self, backwards):
+        # marks share the cursor with search hits
+        marks = self.viewer.marks
+        if self.cursor is None:
+            pos = (sys.maxsize, 0) if backwards else (-1, 0)
+        else:
+            pos = self.cursor
+
+        if backwards:
+            mark = next((m for m in reversed(marks) if m[:2] < pos), None)
+        else:
+            mark = next((m for m in marks if m[:2] > pos), None)
+
+        if mark is None:
+            self.status.set_text('no more marks')
+            return
+
+        index, start, end, timestamp, trigger = mark
+        self.cursor = (index, start)
+
+        if self.viewer.show_range((index, start), (index, end)):
+            self.status.set_text('mark {!r} at {}'.format(
+                trigger.pattern, time.strftime('%H:%M:%S',
+                                               time.localtime(timestamp))))
+        else:
+            self.status.set_text('mark at chunk {} is no longer in '
+                                 'scrollback'.format(index))
+
+
+class PatternBar(Gtk.HBox):
+    ACTIONS = [('highlight', None), ('pause scrolling', 'pause'),
+               ('mark', 'mark'), ('send sequence', 'send')]
+
+    def __init__(self, viewer, *args, **kwargs):
+        super(PatternBar, self).__init__(*args, **kwargs)
+
+        self.viewer = viewer
+
+        self.pattern = Gtk.Entry()
+        self.pattern.set_placeholder_text('pattern to highlight')
+        self.pattern.connect('activate', self._on_add)
+
+        self.regex = Gtk.CheckButton('regex')
+
+        self.action = Gtk.ComboBoxText()
+        for label, _ in self.ACTIONS:
+            self.action.append_text(label)
+        self.action.set_active(0)
+
+        self.sequence = Gtk.Entry()
+        self.sequence.set_placeholder_text('sequence name')
+        self.sequence.set_width_chars(12)
+
+        add = Gtk.Button('Add')
+        add.connect('clicked', self._on_add)
+
+        clear = Gtk.Button('Clear')
+        clear.connect('clicked', lambda _: self.viewer.clear_triggers())
+
+        follow = Gtk.Button('Follow')
+        follow.connect('clicked', lambda _: self.viewer.set_auto_scroll(True))
+
+        self.pack_start(self.pattern, True, True, 0)
+        self.pack_start(self.regex, False, True, 0)
+        self.pack_start(self.action, False, True, 0)
+        self.pack_start(self.sequence, False, True, 0)
+        self.pack_start(add, False, True, 0)
+        self.pack_start(clear, False, True, 0)
+        self.pack_start(follow, False, True, 0)
+
+    def _on_add(self, *args):
+        text = self.pattern.get_text()
+        if not text:
+            return
+
+        action = self.ACTIONS[self.action.get_active()][1]
+
+        try:
+            if self.regex.get_active():
+                pattern = text.encode('latin1')
+                re.compile(pattern)
+            else:
+                pattern = parse_8bit(text)
+        except Exception as e:
+            dlg = Gtk.MessageDialog(self.get_toplevel(), Gtk.DialogFlags.MODAL,
+                                    Gtk.MessageType.ERROR, Gtk.ButtonsType.OK,
+                                    str(e))
+            dlg.run()
+            dlg.destroy()
+            return
+
+        self.viewer.add_trigger(Trigger(pattern, self.regex.get_active(),
+                                        action, self.sequence.get_text()))
+        self.pattern.set_text('')
 
 
 class AutoScrolledWindow(Gtk.ScrolledWindow):
@@ -357,27 +961,288 @@ class AutoScrolledWindow(Gtk.ScrolledWindow):
 
 
 class MultiFormatViewer(Gtk.Notebook):
-    def __init__(self, *args, **kwargs):
+    __gsignals__ = {'end-reached': (GObject.SIGNAL_RUN_FIRST, None, ()),
+                    'pattern-matched': (GObject.SIGNAL_RUN_FIRST, None,
+                                        (object, object)), }
+
+    # bytes rendered into a lagging view per idle callback
+    CATCH_UP_BYTES = 64 * 1024
+
+    # frames kept for the frame view
+    FRAME_ROWS = 10000
+
+    def __init__(self, scrollback_bytes=None, scrollback_lines=None,
+                 spill=False, auto_scroll=True, *args, **kwargs):
         super(MultiFormatViewer, self).__init__(*args, **kwargs)
 
-        self.view_ascii = ASCIIView()
-        self.view_hex = HexView()
+        self.auto_scroll = auto_scroll
+
+        self.store = ChunkStore(scrollback_bytes, scrollback_lines, spill)
+        self.views = []
+        self.scrolls = []
+        self._active = 0
+        self._catch_up_id = None
+
+        # triggers, highlighted ranges per store index and marks, as
+        # (store index, start, end, timestamp, trigger) in stream order
+        self.patterns = PatternSet()
+        self.highlights = {}
+        self.marks = []
+
+        # bytes lost per store index, those chunks are empty placeholders
+        self.gaps = {}
+
+        # every byte in scrollback, or spilled, for searching
+        self.history = ByteHistory(spill)
 
-        scroll_ascii = AutoScrolledWindow()
-        scroll_hex = AutoScrolledWindow()
+        # frames are not part of the store, the frame view shows the most
+        # recent ones and counts with self.frame_count instead of store indices
+        self.frames = deque(maxlen=self.FRAME_ROWS)
+        self.frame_count = 0
+        self.view_frames = None
+
+        # nanoseconds spent per append, handed out by get_stats()
+        self.append_time = Histogram()
+        self._stats_readers = HistogramReaders(self, ('append_time', ))
+
+        self.view_ascii = self.add_view(ASCIIView(), 'ASCII')
+        self.view_hex = self.add_view(HexView(), 'Hex')
+
+        self.connect('switch-page', self._on_switch_page)
+
+    def add_view(self, view, label):
+        scroll = AutoScrolledWindow()
+        scroll.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        scroll.add(view)
+        scroll.enable_auto_scroll = self.auto_scroll
+        scroll.connect('edge-reached', self._on_edge_reached)
 
-        scroll_ascii.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
-        scroll_ascii.add(self.view_ascii)
+        view.first = self.store.first
+        self.views.append(view)
+        self.scrolls.append(scroll)
+        self.append_page(scroll, Gtk.Label(label))
 
-        scroll_hex.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
-        scroll_hex.add(self.view_hex)
+        return view
+
+    def add_frame_view(self):
+        # always the last page, after all chunk views
+        self.view_frames = FrameView()
+
+        scroll = AutoScrolledWindow()
+        scroll.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        scroll.add(self.view_frames)
+        scroll.enable_auto_scroll = self.auto_scroll
+        self.scrolls.append(scroll)
+        self.append_page(scroll, Gtk.Label('Frames'))
+        scroll.show_all()
+
+    @property
+    def active_view(self):
+        # None while the frame view is shown
+        if self._active < len(self.views):
+            return self.views[self._active]
+
+    def set_auto_scroll(self, enabled):
+        self.auto_scroll = enabled
+        for scroll in self.scrolls:
+            scroll.enable_auto_scroll = enabled
+
+    def add_trigger(self, trigger):
+        self.patterns.add(trigger)
+
+    def clear_triggers(self):
+        self.patterns.clear()
+
+    def get_stats(self, reader=None):
+        append_time = self._stats_readers.take(reader)['append_time']
+
+        return {
+            'append_time': append_time.to_json(1e-9),
+            'catch_up_pending': self._catch_up_id is not None,
+            'store_bytes': self.store.size,
+        }
+
+    def append(self, data, direction, timestamp=None):
+        start = time.perf_counter_ns()
+        self._append(data, direction, timestamp)
+        self.append_time.add(time.perf_counter_ns() - start)
+
+    def _append(self, data, direction, timestamp):
+        self.store.append(data, direction, timestamp)
+        index = self.store.end - 1
+        self.history.append(data, direction, index)
+
+        if self.patterns:
+            self._match(data, direction, index)
+
+        # only the visible view is rendered, others catch up once shown
+        view = self.active_view
+        if view is None:
+            pass
+        elif view.end == index:
+            view.append(data, direction, self.highlights.get(index, ()))
+        else:
+            self._schedule_catch_up()
+
+        if self.store.over_limit():
+            self.store.trim()
+            self._sync_trim()
+
+    def append_gap(self, n, direction, timestamp=None):
+        self.store.append(b'', direction, timestamp)
+        index = self.store.end - 1
+        self.gaps[index] = n
+
+        view = self.active_view
+        if view is None:
+            pass
+        elif view.end == index:
+            view.append_gap(n)
+        else:
+            self._schedule_catch_up()
+
+    def append_frames(self, frames, direction):
+        self.frames.extend((frame, direction) for frame in frames)
+        self.frame_count += len(frames)
+
+        if self.active_view is None:
+            self._render_frames()
+
+    def _render_frames(self):
+        view = self.view_frames
+        missing = self.frame_count - view.end
+
+        # more frames arrived while hidden than are kept, start over
+        if missing > len(self.frames):
+            view.trim_head(len(view._chunk_chars))
+            view.first = self.frame_count - len(self.frames)
+            missing = len(self.frames)
+
+        for frame, direction in islice(self.frames, len(self.frames) - missing,
+                                       None):
+            view.append(frame, direction)
+
+        excess = len(view._chunk_chars) - self.FRAME_ROWS
+        if excess > 0:
+            view.trim_head(excess)
+
+    def _match(self, data, direction, index):
+        hits = self.patterns.feed(data, direction)
+        if not hits:
+            return
+
+        self.highlights[index] = [
+            (start, end, 'mark' if trigger.action == 'mark' else 'highlight')
+            for trigger, start, end in hits
+        ]
+
+        for trigger, start, end in hits:
+            if trigger.action == 'pause':
+                self.set_auto_scroll(False)
+            elif trigger.action == 'mark':
+                self.marks.append((index, max(start, 0), end,
+                                   self.store.chunks[-1][2], trigger))
+
+            self.emit('pattern-matched', trigger, data[max(start, 0):end])
+
+    def clear(self):
+        self.store.clear()
+        self._sync_trim()
+
+    def _sync_trim(self):
+        first = self.store.first
+
+        # spilled chunks can still be paged in and shown, keep them searchable
+        # and their gaps, highlights and marks around
+        if not self.store.has_spilled:
+            self.history.trim(first)
+            self.marks = [m for m in self.marks if m[0] >= first]
+
+            for index in [i for i in self.highlights if i < first]:
+                del self.highlights[index]
+            for index in [i for i in self.gaps if i < first]:
+                del self.gaps[index]
+
+        for view in self.views:
+            if view.first < first:
+                view.trim_head(min(first - view.first, len(view._chunk_chars)))
+                view.first = first
+
+    def page_in(self):
+        if self.store.page_in():
+            self._schedule_catch_up()
+
+    def show_range(self, start, end):
+        # selects the bytes between two (store index, offset) positions in
+        # the active view, returns False if they are no longer in scrollback
+        store = self.store
+
+        while start[0] < store.first and store.has_spilled:
+            store.page_in()
+        if start[0] < store.first:
+            return False
+
+        # the frame view has no byte positions, show the text instead
+        if self.active_view is None:
+            self.set_current_page(0)
+            self._active = 0
+
+        view = self.active_view
+        while self._catch_up():
+            pass
+
+        chars = [view.char_offset(index, store.chunks[index - store.first][0],
+                                  offset) for index, offset in (start, end)]
+        view.select(*chars)
+        self.set_auto_scroll(False)
+
+        return True
+
+    def _schedule_catch_up(self):
+        if self._catch_up_id is None:
+            self._catch_up_id = GLib.idle_add(self._catch_up)
+
+    def _catch_up(self):
+        view = self.active_view
+        store = self.store
+
+        if view is None:
+            self._render_frames()
+            self._catch_up_id = None
+            return False
+
+        # data paged in while the view was hidden
+        if view.first > store.first:
+            view.prepend([
+                (data, direction, self.gaps.get(index),
+                 self.highlights.get(index, ()))
+                for index, (data, direction, _) in enumerate(
+                    store.get(store.first, view.first), store.first)
+            ])
+
+        budget = self.CATCH_UP_BYTES
+        while budget > 0 and view.end < store.end:
+            data, direction, _ = store.chunks[view.end - store.first]
+            if view.end in self.gaps:
+                view.append_gap(self.gaps[view.end])
+            else:
+                view.append(data, direction,
+                            self.highlights.get(view.end, ()))
+            budget -= len(data)
+
+        if view.end < store.end:
+            return True
 
-        self.append_page(scroll_ascii, Gtk.Label('ASCII'))
-        self.append_page(scroll_hex, Gtk.Label('Hex'))
+        self._catch_up_id = None
+        return False
 
-        self.scroll_ascii = scroll_ascii
-        self.scroll_hex = scroll_hex
+    def _on_switch_page(self, notebook, page, page_num):
+        self._active = page_num
+        self._schedule_catch_up()
 
-    def append(self, data, direction):
-        self.view_ascii.append(data, direction)
-        self.view_hex.append(data, direction)
+    def _on_edge_reached(self, scroll, pos):
+        if pos == Gtk.PositionType.TOP:
+            self.page_in()
+        elif pos == Gtk.PositionType.BOTTOM:
+            self.store.release()
+            self.emit('end-reached')
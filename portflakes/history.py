@@ -0,0 +1,173 @@
+import mmap
+import re
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+
+DIRECTIONS = ('in', 'out')
+
+
+class DirectionHistory(object):
+    # every byte of one direction in a single buffer, with the store index of
+    # the chunk each run of bytes came from. When spilling, the bytes go to a
+    # temporary file instead, which is mapped for searching.
+
+    def __init__(self, spill=False):
+        self.data = bytearray()
+        self.size = 0
+        self.offsets = array('q')
+        self.indices = array('q')
+
+        self.spill_file = tempfile.TemporaryFile() if spill else None
+        self._map = None
+
+    def append(self, data, index):
+        self.offsets.append(self.size)
+        self.indices.append(index)
+        self.size += len(data)
+
+        if self.spill_file is None:
+            self.data += data
+        else:
+            self.spill_file.write(data)
+
+    def buffer(self):
+        if self.spill_file is None:
+            return self.data
+        if not self.size:
+            return b''
+
+        # remapped only when data was added since the last search
+        if self._map is None or len(self._map) != self.size:
+            self._unmap()
+            self.spill_file.flush()
+            self._map = mmap.mmap(self.spill_file.fileno(), self.size,
+                                  access=mmap.ACCESS_READ)
+        return self._map
+
+    def _unmap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def trim(self, index):
+        # forgets the chunks before store index index
+        i = bisect_left(self.indices, index)
+        if not i:
+            return
+
+        cut = self.offsets[i] if i < len(self.offsets) else self.size
+        self.offsets = array('q', (o - cut for o in self.offsets[i:]))
+        del self.indices[:i]
+        self.size -= cut
+
+        if self.spill_file is None:
+            del self.data[:cut]
+            return
+
+        self._unmap()
+        f = self.spill_file
+        f.seek(cut)
+        rest = f.read()
+        f.seek(0)
+        f.truncate()
+        f.write(rest)
+
+    def position(self, index, offset):
+        # buffer position of offset within chunk index, or of the next chunk
+        # in this direction if index is not one of ours
+        i = bisect_left(self.indices, index)
+        if i == len(self.indices):
+            return self.size
+        if self.indices[i] != index:
+            return self.offsets[i]
+        return self.offsets[i] + offset
+
+    def locate(self, pos):
+        # (store index, offset within that chunk) of a buffer position
+        i = bisect_right(self.offsets, pos) - 1
+        return self.indices[i], pos - self.offsets[i]
+
+
+class ByteHistory(object):
+    # Raw bytes of a whole session, kept apart from any rendering and split
+    # by direction, so matches never span sent and received data. A search
+    # is a single bytes.find or regex scan over a contiguous buffer.
+
+    # window growth when searching backwards with a regex
+    REGEX_WINDOW = 1024 * 1024
+
+    def __init__(self, spill=False):
+        self.directions = {d: DirectionHistory(spill) for d in DIRECTIONS}
+
+    @property
+    def size(self):
+        return sum(h.size for h in self.directions.values())
+
+    def append(self, data, direction, index):
+        if data:
+            self.directions[direction].append(data, index)
+
+    def trim(self, index):
+        for hist in self.directions.values():
+            hist.trim(index)
+
+    def find(self, pattern, index=-1, offset=0, direction=None, regex=False,
+             backwards=False):
+        # finds the first match after (or, backwards, before) the given
+        # position; returns (direction, start, end) with start and end as
+        # (store index, offset) pairs, or None
+        if regex:
+            pattern = re.compile(pattern)
+        elif not pattern:
+            return None
+
+        hits = []
+        for d in ([direction] if direction else DIRECTIONS):
+            hist = self.directions[d]
+            pos = hist.position(index, offset)
+            data = hist.buffer()
+
+            if backwards:
+                span = self._find_back(data, pattern, pos, regex)
+            else:
+                span = self._find(data, pattern, pos, regex)
+
+            if span is not None:
+                hits.append((hist.locate(span[0]), hist.locate(span[1] - 1),
+                             d))
+
+        if not hits:
+            return None
+
+        start, last, d = (max if backwards else min)(hits)
+        return d, start, (last[0], last[1] + 1)
+
+    def _find(self, data, pattern, pos, regex):
+        if regex:
+            m = pattern.search(data, pos)
+            # empty matches would never advance
+            while m is not None and m.start() == m.end():
+                m = pattern.search(data, m.end() + 1)
+            return m.span() if m else None
+
+        start = data.find(pattern, pos)
+        return (start, start + len(pattern)) if start != -1 else None
+
+    def _find_back(self, data, pattern, pos, regex):
+        if not regex:
+            start = data.rfind(pattern, 0, pos + len(pattern) - 1)
+            return (start, start + len(pattern)) if start != -1 else None
+
+        # regexes cannot search backwards, scan growing windows before pos
+        window = self.REGEX_WINDOW
+        while True:
+            lo = max(0, pos - window)
+            span = None
+            for m in pattern.finditer(data, lo, pos):
+                if m.start() != m.end():
+                    span = m.span()
+
+            if span is not None or lo == 0:
+                return span
+            window *= 2
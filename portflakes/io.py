@@ -1,25 +1,99 @@
 import os
+import random
 import time
 import threading
-from queue import Queue
 
-from gi.repository import GObject, GLib
+from .bounded import BoundedQueue
+from .ioloop import IOLoop
+from .stats import IOStats
+from .util import read_chunk
 
 
-class BackgroundIO(GObject.GObject):
-    __gsignals__ = {'data-received': (GObject.SIGNAL_RUN_FIRST, None,
-                                      (object, )),
-                    'data-sent': (GObject.SIGNAL_RUN_FIRST, None,
-                                  (object, )), }
+def thread_timer(interval, callback):
+    # calls callback every interval milliseconds until it returns False,
+    # used wherever there is no main loop to deliver on
+    def run():
+        delay = interval / 1000.0
+        deadline = time.monotonic()
 
-    def __init__(self, *args, **kwargs):
-        super(BackgroundIO, self).__init__(*args, **kwargs)
-        self._send_queue = Queue()
+        while True:
+            deadline += delay
+            time.sleep(max(0, deadline - time.monotonic()))
+
+            if not callback():
+                break
+
+    t = threading.Thread(target=run)
+    t.daemon = True
+    t.start()
+
+
+class BackgroundIO(object):
+    # Signals are emitted batched, at most fps times per second, from
+    # whatever the timer runs on: a plain thread by default, or the GUI main
+    # loop (see gui.glib_timer). Handlers are called as handler(io, data),
+    # same as GObject signal handlers.
+
+    # 'data-dropped' is emitted with (direction, number of bytes) wherever
+    # data was lost to a full buffer
+    SIGNALS = ('data-received', 'data-sent', 'frame-received', 'data-dropped')
+
+    # default buffer limits in bytes, see bounded.BoundedQueue for policies
+    MAX_PENDING = 16 * 1024 * 1024
+    MAX_SEND = 1024 * 1024
+
+    def __init__(self, fps=30, timer=thread_timer, framer=None,
+                 max_pending=MAX_PENDING, pending_policy='drop-oldest',
+                 max_send=MAX_SEND, send_policy='block'):
+        self._send_queue = BoundedQueue(max_send, send_policy)
+
+        # filled from the io threads, drained by the timer once per frame
+        self._pending = BoundedQueue(max_pending, pending_policy)
+
+        # decoded frames are kept apart, so they do not split runs of raw
+        # chunks; their order relative to those does not matter
+        self._frames = BoundedQueue(max_pending, pending_policy)
+        self.fps = fps
+        self.timer = timer
+
+        self._handlers = {signal: [] for signal in self.SIGNALS}
+        self._handler_id = 0
+
+        # called on the io threads with every chunk, before any batching
+        self._taps = []
+
+        # splits received data into frames (see framing.py), on the io thread
+        self.framer = framer
+
+        self.stats = IOStats()
+
+        # bytes lost per signal since the last flush
+        self._lost = {}
+        self._lost_lock = threading.Lock()
+
+        # set by stop(), delivery ends at the next flush
+        self._stopped = threading.Event()
 
     @property
     def name(self):
         return self.__class__.__name__
 
+    def connect(self, signal, handler, *args):
+        if signal not in self._handlers:
+            raise TypeError('Unknown signal {!r}'.format(signal))
+
+        self._handler_id += 1
+        self._handlers[signal].append((self._handler_id, handler, args))
+        return self._handler_id
+
+    def disconnect(self, handler_id):
+        for handlers in self._handlers.values():
+            handlers[:] = [h for h in handlers if h[0] != handler_id]
+
+    def emit(self, signal, *args):
+        for _, handler, extra in list(self._handlers[signal]):
+            handler(self, *(args + extra))
+
     def start_daemon(self):
         self._receive_thread = threading.Thread(
             target=self._run_receive_thread)
@@ -31,8 +105,123 @@ class BackgroundIO(GObject.GObject):
         self._receive_thread.start()
         self._send_thread.start()
 
+        self._start_delivery()
+
+    def _start_delivery(self):
+        self.timer(max(1, 1000 // self.fps), self._flush_pending)
+
+    def stop(self):
+        self._stopped.set()
+
     def send_data(self, data):
-        self._send_queue.put(data)
+        self._dropped(self._send_queue.put(data, len(data)), 'data-sent')
+
+    def _dropped(self, items, signal=None):
+        # items are (item, size) pairs as returned by BoundedQueue.put,
+        # pending items carry their own signal
+        if not items:
+            return
+
+        with self._lost_lock:
+            for item, size in items:
+                sig = signal or item[0]
+                self._lost[sig] = self._lost.get(sig, 0) + size
+                self.stats.dropped(sig, size)
+
+    def _put_pending(self, signal, data, size, now):
+        self._dropped(self._pending.put((signal, data, now), size))
+
+    def send_queue_depth(self):
+        return self._send_queue.qsize()
+
+    def get_stats(self, reader=None):
+        stats = self.stats.snapshot(reader)
+        stats['send_queue'] = self.send_queue_depth()
+        stats['pending'] = len(self._pending)
+
+        # frames thrown away as malformed or handed out unterminated
+        if self.framer is not None:
+            stats['frames'] = self.framer.frames
+            stats['frame_errors'] = self.framer.errors
+            stats['frame_overflows'] = self.framer.overflows
+        return stats
+
+    def add_tap(self, tap):
+        self._taps.append(tap)
+
+    def remove_tap(self, tap):
+        self._taps.remove(tap)
+
+    def _deliver(self, signal, data):
+        for tap in self._taps:
+            tap(signal, data)
+
+        if signal == 'data-received':
+            self.stats.received(len(data))
+        else:
+            self.stats.sent(len(data))
+
+        now = time.perf_counter_ns()
+        self._put_pending(signal, data, len(data), now)
+
+        if self.framer is not None and signal == 'data-received':
+            frames = self.framer.feed(data)
+            if frames:
+                self._dropped(self._frames.put(frames, sum(map(len, frames))),
+                              'frame-received')
+
+    def _flush_pending(self):
+        if self._stopped.is_set():
+            return False
+
+        items = self._pending.drain()
+        frames = [f for batch in self._frames.drain() for f in batch]
+
+        # frames completed here are emitted right away: queueing them could
+        # block on the very queue this timer is supposed to drain
+        if self.framer is not None:
+            frames += self.framer.poll()
+
+        with self._lost_lock:
+            lost, self._lost = self._lost, {}
+
+        if not items and not lost and not frames:
+            return True
+        self.stats.flushed(len(items))
+
+        # merge consecutive chunks of the same direction, preserving order
+        batches = []
+        for signal, data, received in items:
+            if batches and batches[-1][0] == signal:
+                batches[-1][1].append(data)
+            else:
+                batches.append((signal, [data], received))
+
+        # the oldest data is lost before what is left, the newest after it;
+        # either way the gap is placed to within one flush
+        gaps = [(direction, lost[signal]) for signal, direction in
+                (('data-received', 'in'), ('data-sent', 'out'))
+                if signal in lost]
+        if self._pending.policy == 'drop-oldest':
+            for gap in gaps:
+                self.emit('data-dropped', *gap)
+
+        for signal, chunks, received in batches:
+            self.emit(signal, b''.join(chunks))
+
+            # handlers render right away, so this is the oldest chunk's delay
+            # from being read to being shown
+            self.stats.delivered(time.perf_counter_ns() - received)
+
+        # all frames of this flush at once, handed out as a list
+        if frames:
+            self.emit('frame-received', frames)
+
+        if self._pending.policy != 'drop-oldest':
+            for gap in gaps:
+                self.emit('data-dropped', *gap)
+
+        return True
 
     def _run_receive_thread(self):
         raise NotImplementedError()
@@ -47,22 +236,67 @@ class BackgroundIO(GObject.GObject):
         return instance
 
 
-class RandomDataGenerator(BackgroundIO):
-    def __init__(self, delay, *args, **kwargs):
-        super(RandomDataGenerator, self).__init__(*args, **kwargs)
+class LoadGenerator(BackgroundIO):
+    # Pseudo-device producing traffic at a target rate. Chunks are sized by
+    # chunk_size() and filled from source (see load.py); pacing advances a
+    # monotonic deadline by the nominal duration of every chunk.
+
+    # how far behind schedule the generator may fall before it gives up on
+    # catching up
+    MAX_BEHIND = 1.0
+
+    def __init__(self, source, chunk_size, rate=None, delay=0.0,
+                 direction='in', *args, **kwargs):
+        super(LoadGenerator, self).__init__(*args, **kwargs)
+        self.source = source
+        self.chunk_size = chunk_size
+        self.rate = rate
         self.delay = delay
+        self.direction = direction
+
+        # bytes generated, and times the rate could not be kept up
+        self.generated = 0
+        self.late = 0
+
+    def get_stats(self, reader=None):
+        stats = super(LoadGenerator, self).get_stats(reader)
+        stats['generated'] = self.generated
+        stats['behind_schedule'] = self.late
+        return stats
 
     def _run_send_thread(self):
+        # there is no device, just show what would have been sent
         while True:
-            data = b'ABC\n\x12'
-            GLib.idle_add(self.emit, 'data-sent', data)
-            time.sleep(self.delay)
+            data = self._send_queue.get()
+            self._deliver('data-sent', data)
+
+    def _signal(self):
+        direction = self.direction
+        if direction == 'both':
+            direction = random.choice(('in', 'out'))
+        return 'data-received' if direction == 'in' else 'data-sent'
 
     def _run_receive_thread(self):
+        deadline = time.monotonic()
+
         while True:
-            data = os.urandom(2)
-            GLib.idle_add(self.emit, 'data-received', data)
-            time.sleep(self.delay)
+            data = self.source.read(self.chunk_size())
+
+            # a rate of 0 generates as fast as possible
+            if self.rate is None:
+                deadline += self.delay
+            elif self.rate:
+                deadline += len(data) / float(self.rate)
+            delay = deadline - time.monotonic()
+
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -self.MAX_BEHIND:
+                self.late += 1
+                deadline = time.monotonic()
+
+            self._deliver(self._signal(), data)
+            self.generated += len(data)
 
 
 class Echo(BackgroundIO):
@@ -70,35 +304,218 @@ class Echo(BackgroundIO):
         while True:
             data = self._send_queue.get()
 
-            GLib.idle_add(self.emit, 'data-sent', data)
+            self._deliver('data-sent', data)
 
             # receive right away
-            GLib.idle_add(self.emit, 'data-received', data)
+            self._deliver('data-received', data)
 
     def _run_receive_thread(self):
         pass
 
 
+class ReplayIO(BackgroundIO):
+    def __init__(self, reader, speed=1.0, loop=False, *args, **kwargs):
+        super(ReplayIO, self).__init__(*args, **kwargs)
+        self.reader = reader
+        self.speed = speed
+        self.loop = loop
+
+    @property
+    def name(self):
+        return os.path.basename(self.reader.path)
+
+    def _run_send_thread(self):
+        # there is no device to send to, just show what would have been sent
+        while True:
+            data = self._send_queue.get()
+            self._deliver('data-sent', data)
+
+    def _run_receive_thread(self):
+        # looping over an empty capture would never sleep
+        while True:
+            self._replay()
+
+            if not self.loop or self.reader.empty:
+                break
+
+    def _replay(self):
+        start = None
+
+        for timestamp, direction, data in self.reader.records():
+            # a speed of 0 replays as fast as possible
+            if self.speed:
+                now = time.monotonic_ns()
+                if start is None:
+                    start = (now, timestamp)
+
+                due = start[0] + (timestamp - start[1]) / self.speed
+                if due > now:
+                    time.sleep((due - now) / 1e9)
+
+            self._deliver('data-received' if direction == 'in' else
+                          'data-sent', data)
+
+
 class SerialIO(BackgroundIO):
-    def __init__(self, ser, *args, **kwargs):
+    # small queued sends are merged into writes of up to this many bytes
+    MAX_COALESCED_SEND = 4096
+
+    def __init__(self, ser, max_chunk=65536, coalesce=0.0, send_chunk=None,
+                 send_delay=0.0, send_rate=None, *args, **kwargs):
         super(SerialIO, self).__init__(*args, **kwargs)
         self.ser = ser
+        self.max_chunk = max_chunk
+        self.coalesce = coalesce
+
+        # pacing: bytes per write, pause after each write and bytes/s limit
+        self.send_chunk = send_chunk
+        self.send_delay = send_delay
+        self.send_rate = send_rate
+        self._next_write = 0.0
 
     @property
     def name(self):
         return self.ser.port
 
+    def stop(self):
+        # wakes both threads up and waits for them, the port can be closed
+        # afterwards
+        super(SerialIO, self).stop()
+        self.ser.cancel_read()
+        self._send_queue.put(b'', 0)
+
+        # delivery has ended, so with the block policy a thread may be
+        # waiting for room in a queue nobody drains anymore
+        for t in (self._receive_thread, self._send_thread):
+            while t.is_alive():
+                self._pending.drain()
+                self._frames.drain()
+                t.join(0.1)
+
+    def _next_send(self):
+        data = self._send_queue.get()
+
+        if self._send_queue.empty():
+            return data
+
+        chunks = [data]
+        size = len(data)
+        while size < self.MAX_COALESCED_SEND and not self._send_queue.empty():
+            chunks.append(self._send_queue.get_nowait())
+            size += len(chunks[-1])
+
+        return b''.join(chunks)
+
+    def _pace(self, n):
+        if not (self.send_delay or self.send_rate):
+            return
+
+        # deadlines are advanced from the previous one, so sleeping late
+        # does not accumulate into drift
+        now = time.monotonic()
+        self._next_write = max(self._next_write, now) + self.send_delay
+        if self.send_rate:
+            self._next_write += n / float(self.send_rate)
+
+        if self._next_write > now:
+            time.sleep(self._next_write - now)
+
     def _run_send_thread(self):
-        while True:
-            data = self._send_queue.get()
+        while not self._stopped.is_set():
+            data = self._next_send()
+            view = memoryview(data)
+            chunk = self.send_chunk or len(view)
+
+            while view:
+                # pyserial copies anything but bytes, so unless data has to
+                # be split it is handed over as it is
+                if chunk >= len(view) == len(data):
+                    n = self.ser.write(data)
+                else:
+                    n = self.ser.write(view[:chunk])
 
-            idx = 0
-            while idx != len(data):
-                bytes_sent = self.ser.write(data[idx:])
-                idx += bytes_sent
-                GLib.idle_add(self.emit, 'data-sent', data)
+                # report exactly what went out
+                if n == len(data):
+                    self._deliver('data-sent', data)
+                else:
+                    self._deliver('data-sent', view[:n].tobytes())
+
+                view = view[n:]
+                self._pace(n)
 
     def _run_receive_thread(self):
-        while True:
-            data = self.ser.read()
-            GLib.idle_add(self.emit, 'data-received', data)
+        while not self._stopped.is_set():
+            data = read_chunk(self.ser, self.max_chunk, self.coalesce)
+            if data:
+                self._deliver('data-received', data)
+
+
+class PolledSerialIO(BackgroundIO):
+    # Served by a shared IOLoop instead of two threads per port, so any
+    # number of ports can be monitored from a single thread.
+
+    def __init__(self, ser, max_chunk=65536, loop=None, *args, **kwargs):
+        super(PolledSerialIO, self).__init__(*args, **kwargs)
+        self.ser = ser
+        self.max_chunk = max_chunk
+        self.loop = loop
+
+        # data taken from the send queue, only touched from the loop thread
+        self._out = bytearray()
+
+    @property
+    def name(self):
+        return self.ser.port
+
+    def start_daemon(self):
+        if self.loop is None:
+            self.loop = IOLoop.default()
+
+        self._fd = self.ser.fileno()
+        os.set_blocking(self._fd, False)
+        self.loop.add_reader(self._fd, self._on_readable)
+
+        self._start_delivery()
+
+    def send_data(self, data):
+        super(PolledSerialIO, self).send_data(data)
+        self.loop.add_writer(self._fd, self._on_writable)
+
+    def _on_writable(self):
+        if not self._out:
+            self._out += b''.join(self._send_queue.drain())
+
+        if not self._out:
+            self.loop.remove_writer(self._fd)
+            return
+
+        try:
+            n = os.write(self._fd, self._out)
+        except BlockingIOError:
+            return
+        except OSError:
+            # device went away, stop polling it
+            del self._out[:]
+            self.loop.remove_writer(self._fd)
+            self.loop.remove_reader(self._fd)
+            return
+
+        self._deliver('data-sent', bytes(self._out[:n]))
+        del self._out[:n]
+
+        if not self._out:
+            self.loop.remove_writer(self._fd)
+
+    def _on_readable(self):
+        try:
+            data = os.read(self._fd, self.max_chunk)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+
+        if data:
+            self._deliver('data-received', data)
+        else:
+            # device went away, stop polling it
+            self.loop.remove_reader(self._fd)
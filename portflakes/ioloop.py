@@ -0,0 +1,142 @@
+import heapq
+import os
+import selectors
+import threading
+import time
+import traceback
+from collections import deque
+
+
+class IOLoop(object):
+    # A single thread multiplexing any number of file descriptors with
+    # selectors. Other threads hand work to it through call_soon, which wakes
+    # the selector through a pipe.
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._calls = deque()
+        self._timers = []
+        self._timer_seq = 0
+
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ,
+                                (self._drain_wakeup, None))
+
+        self._thread = None
+
+    @classmethod
+    def default(cls):
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+                cls._default.start()
+            return cls._default
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def in_loop(self):
+        return threading.current_thread() is self._thread
+
+    def call_soon(self, func, *args):
+        self._calls.append((func, args))
+        try:
+            os.write(self._wake_w, b'\0')
+        except BlockingIOError:
+            # the pipe is full, so a wakeup is pending anyway
+            pass
+
+    def call_later(self, delay, func, *args):
+        self.call_at(time.monotonic() + delay, func, *args)
+
+    def call_at(self, deadline, func, *args):
+        if not self.in_loop():
+            self.call_soon(self.call_at, deadline, func, *args)
+            return
+
+        self._timer_seq += 1
+        heapq.heappush(self._timers, (deadline, self._timer_seq, func, args))
+
+    def add_reader(self, fd, callback):
+        self._update(fd, callback, selectors.EVENT_READ)
+
+    def remove_reader(self, fd):
+        self._update(fd, None, selectors.EVENT_READ)
+
+    def add_writer(self, fd, callback):
+        self._update(fd, callback, selectors.EVENT_WRITE)
+
+    def remove_writer(self, fd):
+        self._update(fd, None, selectors.EVENT_WRITE)
+
+    def _update(self, fd, callback, event):
+        if not self.in_loop():
+            self.call_soon(self._update, fd, callback, event)
+            return
+
+        try:
+            key = self._selector.get_key(fd)
+        except KeyError:
+            key = None
+
+        reader, writer = key.data if key else (None, None)
+        if event == selectors.EVENT_READ:
+            reader = callback
+        else:
+            writer = callback
+
+        mask = ((selectors.EVENT_READ if reader else 0) |
+                (selectors.EVENT_WRITE if writer else 0))
+
+        if key is None:
+            if mask:
+                self._selector.register(fd, mask, (reader, writer))
+        elif mask:
+            self._selector.modify(fd, mask, (reader, writer))
+        else:
+            self._selector.unregister(fd)
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _run_callback(self, func, *args):
+        # one failing device must not stop the loop for all the others
+        try:
+            func(*args)
+        except Exception:
+            traceback.print_exc()
+
+    def run(self):
+        while True:
+            timeout = None
+            if self._timers:
+                timeout = max(0, self._timers[0][0] - time.monotonic())
+            if self._calls:
+                timeout = 0
+
+            for key, events in self._selector.select(timeout):
+                reader, writer = key.data
+                if events & selectors.EVENT_READ and reader:
+                    self._run_callback(reader)
+                if events & selectors.EVENT_WRITE and writer:
+                    self._run_callback(writer)
+
+            for _ in range(len(self._calls)):
+                func, args = self._calls.popleft()
+                self._run_callback(func, *args)
+
+            now = time.monotonic()
+            while self._timers and self._timers[0][0] <= now:
+                _, _, func, args = heapq.heappop(self._timers)
+                self._run_callback(func, *args)
@@ -0,0 +1,98 @@
+import os
+import random
+
+from .framing import SLIPFramer
+
+PAYLOADS = ('random', 'text', 'frames', 'file')
+
+# bytes generated up front for the cyclic payloads
+BLOCK_SIZE = 256 * 1024
+
+
+class CyclicSource(object):
+    # hands out a block of bytes over and over, in slices of any size
+
+    def __init__(self, block):
+        if not block:
+            raise ValueError('Payload must not be empty')
+
+        self.block = block
+        self._double = block + block
+        self.pos = 0
+
+    def read(self, n):
+        size = len(self.block)
+        if n <= size:
+            data = self._double[self.pos:self.pos + n]
+        else:
+            data = (self._double[self.pos:self.pos + size] *
+                    (n // size + 1))[:n]
+
+        self.pos = (self.pos + n) % size
+        return data
+
+
+class RandomSource(object):
+    def read(self, n):
+        return os.urandom(n)
+
+
+def text_lines(size=BLOCK_SIZE):
+    lines = []
+    total = 0
+    n = 0
+
+    while total < size:
+        line = 'seq={} temperature={:.1f} humidity={} status={}\r\n'.format(
+            n, 20 + (n % 50) / 10.0, 40 + n % 7, 'OK' if n % 13 else 'WARN')
+        lines.append(line.encode('ascii'))
+        total += len(line)
+        n += 1
+
+    return b''.join(lines)
+
+
+def framed_packets(framer, size=BLOCK_SIZE):
+    packets = []
+    total = 0
+
+    while total < size:
+        packet = framer.encode(os.urandom(random.randint(4, 64)))
+        packets.append(packet)
+        total += len(packet)
+
+    return b''.join(packets)
+
+
+def make_source(payload, framer=None, template=None):
+    if payload == 'random':
+        return RandomSource()
+    if payload == 'text':
+        return CyclicSource(text_lines())
+    if payload == 'frames':
+        return CyclicSource(framed_packets(framer or SLIPFramer()))
+    if payload == 'file':
+        with open(template, 'rb') as f:
+            return CyclicSource(f.read())
+
+    raise ValueError('Unknown payload {!r}'.format(payload))
+
+
+def parse_distribution(spec):
+    # N, MIN-MAX (uniform) or exp:MEAN, returning a callable giving sizes
+    if spec.startswith('exp:'):
+        mean = float(spec[4:])
+        if mean <= 0:
+            raise ValueError('Mean chunk size must be positive')
+        return lambda: max(1, int(random.expovariate(1.0 / mean)))
+
+    if '-' in spec:
+        lo, hi = (int(v) for v in spec.split('-', 1))
+        if not 0 < lo <= hi:
+            raise ValueError('Invalid chunk size range {!r}'.format(spec))
+        return lambda: random.randint(lo, hi)
+
+    size = int(spec)
+    if size < 1:
+        raise ValueError('Chunk size must be positive')
+    return lambda: size
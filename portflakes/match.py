@@ -0,0 +1,200 @@
+import re
+from collections import deque
+
+
+class StreamMatcher(object):
+    # Aho-Corasick automaton compiled into a full transition table, so every
+    # received byte costs a single lookup and the only state carried across
+    # chunk boundaries is the current automaton state.
+
+    def __init__(self, patterns):
+        self.patterns = [bytes(p) for p in patterns]
+        if not self.patterns or not all(self.patterns):
+            raise ValueError('Patterns must not be empty')
+
+        self._build()
+        self.reset()
+
+    def _build(self):
+        goto = [{}]
+        out = [[]]
+
+        for idx, pattern in enumerate(self.patterns):
+            state = 0
+            for c in pattern:
+                if c not in goto[state]:
+                    goto.append({})
+                    out.append([])
+                    goto[state][c] = len(goto) - 1
+                state = goto[state][c]
+            out[state].append(idx)
+
+        # breadth-first, so failure targets are complete before their use
+        delta = [None] * len(goto)
+        fail = [0] * len(goto)
+
+        delta[0] = [goto[0].get(c, 0) for c in range(256)]
+        queue = deque(goto[0].values())
+
+        while queue:
+            state = queue.popleft()
+            row = list(delta[fail[state]])
+
+            for c, nxt in goto[state].items():
+                fail[nxt] = delta[fail[state]][c] if state else 0
+                out[nxt] = out[nxt] + out[fail[nxt]]
+                row[c] = nxt
+                queue.append(nxt)
+
+            delta[state] = row
+
+        self._delta = delta
+        self._out = [tuple(o) for o in out]
+
+        # from the root state, jump straight to the next possible first byte
+        firsts = sorted(goto[0])
+        self._skip = re.compile(b'[' + b''.join(
+            re.escape(bytes([c])) for c in firsts) + b']').search
+
+    def reset(self):
+        self.state = 0
+        self.offset = 0
+
+    def feed(self, data):
+        # returns (pattern index, start, end) tuples of stream offsets
+        delta = self._delta
+        out = self._out
+        skip = self._skip
+        patterns = self.patterns
+        state = self.state
+        matches = []
+
+        i = 0
+        n = len(data)
+        while i < n:
+            if not state:
+                m = skip(data, i)
+                if m is None:
+                    break
+                i = m.start()
+
+            state = delta[state][data[i]]
+            i += 1
+
+            if out[state]:
+                end = self.offset + i
+                matches.extend((idx, end - len(patterns[idx]), end)
+                               for idx in out[state])
+
+        self.state = state
+        self.offset += n
+
+        return matches
+
+
+class RegexMatcher(object):
+    # Regular expressions are combined into a single alternation. Matches may
+    # span chunk boundaries as long as they start within the last `lookback`
+    # bytes of previous data.
+
+    def __init__(self, patterns, lookback=256):
+        self.patterns = list(patterns)
+        self.lookback = lookback
+        self._regex = re.compile(b'|'.join(
+            b'(?P<p' + str(idx).encode('ascii') + b'>' + p + b')'
+            for idx, p in enumerate(self.patterns)))
+        self.reset()
+
+    def reset(self):
+        self.tail = b''
+        self.offset = 0
+        self._last_end = 0
+
+    def feed(self, data):
+        buf = self.tail + data
+        base = self.offset - len(self.tail)
+        matches = []
+
+        for m in self._regex.finditer(buf):
+            start, end = base + m.start(), base + m.end()
+
+            # skip matches seen before or overlapping one already reported
+            if end <= self.offset or start < self._last_end or start == end:
+                continue
+
+            matches.append((int(m.lastgroup[1:]), start, end))
+            self._last_end = end
+
+        self.offset += len(data)
+        self.tail = buf[-self.lookback:] if self.lookback else b''
+
+        return matches
+
+
+class Trigger(object):
+    ACTIONS = (None, 'pause', 'mark', 'send')
+
+    def __init__(self, pattern, regex=False, action=None, sequence=None):
+        if action not in self.ACTIONS:
+            raise ValueError('Unknown action {!r}'.format(action))
+
+        self.pattern = pattern
+        self.regex = regex
+        self.action = action
+        self.sequence = sequence
+
+    def __repr__(self):
+        return 'Trigger({!r}, regex={}, action={})'.format(
+            self.pattern, self.regex, self.action)
+
+
+class PatternSet(object):
+    # Runs a set of triggers over both directions of a session. Each
+    # direction is matched separately, so sent and received data never
+    # form a match together.
+
+    def __init__(self, triggers=(), lookback=256):
+        self.triggers = list(triggers)
+        self.lookback = lookback
+        self._compile()
+
+    def _compile(self):
+        self._matchers = {}
+
+        literal = [t for t in self.triggers if not t.regex]
+        regex = [t for t in self.triggers if t.regex]
+
+        for direction in ('in', 'out'):
+            matchers = []
+            if literal:
+                matchers.append((StreamMatcher([t.pattern for t in literal]),
+                                 literal))
+            if regex:
+                matchers.append((RegexMatcher([t.pattern for t in regex],
+                                              self.lookback), regex))
+            self._matchers[direction] = matchers
+
+    def __bool__(self):
+        return bool(self.triggers)
+
+    def add(self, trigger):
+        self.triggers.append(trigger)
+        self._compile()
+
+    def clear(self):
+        self.triggers = []
+        self._compile()
+
+    def feed(self, data, direction):
+        # returns (trigger, start, end) with offsets relative to data, start
+        # may be negative for matches beginning in an earlier chunk
+        hits = []
+
+        for matcher, triggers in self._matchers[direction]:
+            chunk_start = matcher.offset
+            for idx, start, end in matcher.feed(data):
+                hits.append((triggers[idx], start - chunk_start,
+                             end - chunk_start))
+
+        hits.sort(key=lambda h: h[1])
+        return hits
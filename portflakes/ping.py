@@ -0,0 +1,157 @@
+import threading
+import time
+from collections import deque
+
+from .match import StreamMatcher
+from .stats import Histogram, latency_summary
+
+
+class Request(object):
+    __slots__ = ('seq', 'end', 'queued', 'sent', 'received')
+
+    def __init__(self, seq, end, queued):
+        self.seq = seq
+        self.end = end
+        self.queued = queued
+        self.sent = None
+        self.received = None
+
+    @property
+    def latency(self):
+        # nanoseconds from the request's last byte being written to the
+        # response being read
+        return self.received - (self.sent or self.queued)
+
+
+class Pinger(object):
+    # Sends a request repeatedly over a BackgroundIO and matches responses
+    # in order. Both ends are timestamped in taps, i.e. on the io threads as
+    # data is written and read, not when the GUI or the caller get to it.
+
+    def __init__(self, io, request, expect, count=10, interval=0.1,
+                 pipeline=1, timeout=1.0, on_result=None):
+        self.io = io
+        self.request = request
+        self.matcher = StreamMatcher(expect)
+        self.count = count
+        self.interval = interval
+        self.pipeline = pipeline
+        self.timeout = timeout
+        self.on_result = on_result
+
+        self._cond = threading.Condition()
+        self._sent_bytes = 0
+        self._queued_bytes = 0
+
+        # requests not fully written yet, and written but unanswered
+        self._unsent = deque()
+        self._outstanding = deque()
+
+        self.results = []
+        self.sent = 0
+        self.timeouts = 0
+        self.unexpected = 0
+
+    def _tap(self, signal, data):
+        now = time.perf_counter_ns()
+
+        with self._cond:
+            if signal == 'data-sent':
+                self._sent_bytes += len(data)
+                while self._unsent and self._unsent[0].end <= self._sent_bytes:
+                    self._unsent.popleft().sent = now
+                    self.sent += 1
+                return
+
+            for _ in self.matcher.feed(data):
+                # nothing is waiting, or the reply came before the request
+                # went out, i.e. it is a late one for an expired request
+                req = self._outstanding[0] if self._outstanding else None
+                if req is None or req.sent is None or now < req.sent:
+                    self.unexpected += 1
+                    continue
+
+                req = self._outstanding.popleft()
+                req.received = now
+                self._done(req)
+
+    def _done(self, req):
+        # called with the lock held
+        self.results.append(req)
+        self._cond.notify_all()
+
+        if self.on_result:
+            self.on_result(req)
+
+    def _expire(self):
+        # called with the lock held; a partial late reply must not complete
+        # with the next one, so matching starts over
+        deadline = time.perf_counter_ns() - int(self.timeout * 1e9)
+
+        while self._outstanding and self._outstanding[0].queued < deadline:
+            req = self._outstanding.popleft()
+            self.timeouts += 1
+            self.matcher.reset()
+            self._done(req)
+
+    def _wait(self, predicate, until=None):
+        with self._cond:
+            while True:
+                self._expire()
+                if predicate():
+                    return True
+
+                wait = 0.01
+                if until is not None:
+                    wait = min(wait, until - time.monotonic())
+                    if wait <= 0:
+                        return False
+                self._cond.wait(wait)
+
+    def run(self):
+        self.io.add_tap(self._tap)
+        try:
+            self._run()
+        finally:
+            self.io.remove_tap(self._tap)
+
+        return self.summary()
+
+    def _run(self):
+        deadline = time.monotonic()
+
+        for seq in range(self.count):
+            self._wait(lambda: len(self._outstanding) < self.pipeline)
+
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            deadline += self.interval
+
+            with self._cond:
+                self._queued_bytes += len(self.request)
+                req = Request(seq, self._queued_bytes, time.perf_counter_ns())
+                self._unsent.append(req)
+                self._outstanding.append(req)
+
+            self.io.send_data(self.request)
+
+        self._wait(lambda: not self._outstanding)
+
+    def summary(self):
+        latencies = sorted(r.latency for r in self.results
+                           if r.received is not None)
+        hist = Histogram()
+        for latency in latencies:
+            hist.add(latency)
+
+        summary = {
+            'sent': self.sent,
+            'responses': len(latencies),
+            'timeouts': self.timeouts,
+            'unexpected': self.unexpected,
+            'histogram': hist.to_json(1e-9)['buckets'] if latencies else [],
+        }
+        summary.update(latency_summary(latencies, 1e-9))
+
+        return summary
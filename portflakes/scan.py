@@ -0,0 +1,120 @@
+import time
+from itertools import product
+
+import serial
+
+from .detect import error_counters, score
+from .match import StreamMatcher
+
+# ordered by how commonly they are found in the wild
+BAUDRATES = [115200, 9600, 57600, 38400, 19200, 230400, 14400, 28800, 56000,
+             128000, 153600, 256000]
+
+PARITIES = ['none', 'even', 'odd', 'mark', 'space']
+
+STOPBITS = [serial.STOPBITS_ONE, serial.STOPBITS_TWO,
+            serial.STOPBITS_ONE_POINT_FIVE]
+
+
+def candidates(stopbits=False, flow=False):
+    # a receiver only ever checks the first stop bit, and flow control only
+    # throttles our side, so neither changes what we read back unless asked
+    stops = STOPBITS if stopbits else STOPBITS[:1]
+    flows = (False, True) if flow else (False, )
+
+    for stop, xonxoff, rts, dsr, parity, baudrate in product(
+            stops, flows, flows, flows, PARITIES, BAUDRATES):
+        yield {
+            'baudrate': baudrate,
+            'bytesize': 8,
+            'parity': getattr(serial, 'PARITY_' + parity.upper()),
+            'stopbits': stop,
+            'xonxoff': xonxoff,
+            'rtscts': rts,
+            'dsrdtr': dsr,
+        }
+
+
+def format_settings(settings):
+    flow = [name for name in ('xonxoff', 'rtscts', 'dsrdtr') if settings[name]]
+    return '{} {}{}{}{}'.format(settings['baudrate'], settings['bytesize'],
+                                settings['parity'], settings['stopbits'],
+                                ' ' + ','.join(flow) if flow else '')
+
+
+def wait_for(ser, matcher, timeout, sample_size=64):
+    # stop as soon as a pattern matches; the matcher carries partial matches
+    # across reads, so nothing is scanned twice
+    matcher.reset()
+    deadline = time.monotonic() + timeout
+    sample = bytearray()
+
+    while time.monotonic() < deadline:
+        data = ser.read(max(1, ser.in_waiting))
+        if len(sample) < sample_size:
+            sample += data[:sample_size - len(sample)]
+
+        if matcher.feed(data):
+            return bytes(sample), True
+
+    return bytes(sample), False
+
+
+def probe(ser, settings, send=None, sample_size=64, matcher=None):
+    ser.apply_settings(settings)
+    ser.reset_input_buffer()
+
+    if send is not None:
+        ser.write(send)
+
+    before = error_counters(ser)
+    if matcher is None:
+        sample, matched = ser.read(sample_size), None
+    else:
+        sample, matched = wait_for(ser, matcher, ser.timeout, sample_size)
+    after = error_counters(ser)
+
+    errors = after - before if None not in (before, after) else None
+    return sample, errors, matched
+
+
+def scan(ser, cands, send=None, sample_size=64, accept=None, report=None,
+         expect=None):
+    results = []
+    matcher = StreamMatcher(expect) if expect else None
+
+    for settings in cands:
+        try:
+            sample, errors, matched = probe(ser, settings, send, sample_size,
+                                            matcher)
+        except Exception as e:
+            # not every driver supports every setting (e.g. mark parity)
+            sample, errors, matched, failure = b'', None, False, str(e)
+        else:
+            failure = None
+
+        sc, sig = score(sample, errors)
+
+        # an expected response beats any statistics
+        if matched is not None:
+            sc = 1.0 if matched else 0.0
+
+        result = {
+            'settings': settings,
+            'bytes': len(sample),
+            'errors': errors,
+            'score': sc,
+            'signals': sig,
+            'failure': failure,
+            'matched': matched,
+        }
+        results.append(result)
+
+        if report:
+            report(result)
+
+        if accept is not None and sc >= accept:
+            break
+
+    results.sort(key=lambda r: r['score'], reverse=True)
+    return results
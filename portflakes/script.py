@@ -0,0 +1,189 @@
+import threading
+import time
+
+from .match import StreamMatcher
+from .stats import latency_summary
+from .util import parse_8bit
+
+# bytes kept between a send and the expect step that waits for its response
+MAX_PENDING = 64 * 1024
+
+# how far behind its deadline a step may start before it is counted as late
+LATE_THRESHOLD = 0.001
+
+
+def _patterns(value):
+    if isinstance(value, str):
+        value = [value]
+    return [parse_8bit(v) for v in value]
+
+
+def compile_script(steps, sequences={}):
+    # validates a script and converts it into (kind, args) tuples, named
+    # sequences are looked up as precompiled bytes
+    compiled = []
+
+    for step in steps:
+        if 'send' in step:
+            compiled.append(('send', parse_8bit(step['send'])))
+        elif 'sequence' in step:
+            name = step['sequence']
+            if name not in sequences:
+                raise ValueError('Unknown sequence {!r}'.format(name))
+            compiled.append(('send', sequences[name]))
+        elif 'delay' in step:
+            compiled.append(('delay', float(step['delay'])))
+        elif 'expect' in step:
+            compiled.append(('expect', StreamMatcher(_patterns(
+                step['expect'])), float(step.get('timeout', 1.0))))
+        elif 'repeat' in step:
+            compiled.append(('repeat', int(step['repeat']),
+                             compile_script(step['steps'], sequences)))
+        elif 'rate' in step:
+            compiled.append(('rate', float(step['rate']),
+                             int(step['count']),
+                             compile_script(step['steps'], sequences)))
+        else:
+            raise ValueError('Invalid script step {!r}'.format(step))
+
+    return compiled
+
+
+class ScriptRunner(object):
+    # Runs a compiled script against a send function. Received data is
+    # passed in through feed(), from any thread. All steps are scheduled
+    # against a monotonic deadline, which is advanced by the nominal
+    # duration of each step, so late wakeups do not add up.
+
+    def __init__(self, steps, send, on_result=None, clock=time.monotonic):
+        self.steps = steps
+        self._send = send
+        self.on_result = on_result
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._matched = threading.Event()
+        self._matcher = None
+        self._pending = bytearray()
+        self._response = bytearray()
+        self._stop = threading.Event()
+
+        self.deadline = None
+        self.sent = 0
+        self.late = 0
+        self.results = []
+
+    def stop(self):
+        self._stop.set()
+        self._matched.set()
+
+    def feed(self, data):
+        with self._lock:
+            if self._matcher is None:
+                if len(self._pending) < MAX_PENDING:
+                    self._pending += data
+                return
+
+            if len(self._response) < MAX_PENDING:
+                self._response += data
+
+            if self._matcher.feed(data):
+                self._matcher = None
+                self._matched.set()
+
+    def run(self):
+        self.deadline = self.clock()
+        self._run(self.steps)
+        return self.summary()
+
+    def _sleep_until(self, deadline):
+        delay = deadline - self.clock()
+        if delay > 0:
+            self._stop.wait(delay)
+        elif delay < -LATE_THRESHOLD:
+            self.late += 1
+
+    def _run(self, steps):
+        for step in steps:
+            if self._stop.is_set():
+                return
+
+            kind = step[0]
+
+            if kind == 'send':
+                self._sleep_until(self.deadline)
+                with self._lock:
+                    del self._pending[:]
+                self._sent_at = self.clock()
+                self._send(step[1])
+                self.sent += 1
+
+            elif kind == 'delay':
+                self.deadline += step[1]
+
+            elif kind == 'expect':
+                self._expect(step[1], step[2])
+
+            elif kind == 'repeat':
+                for _ in range(step[1]):
+                    self._run(step[2])
+
+            elif kind == 'rate':
+                period = 1.0 / step[1]
+                start = self.deadline
+
+                for i in range(step[2]):
+                    if self._stop.is_set():
+                        return
+                    self.deadline = start + i * period
+                    self._run(step[3])
+
+                self.deadline = max(self.deadline, start + step[2] * period)
+
+    def _expect(self, matcher, timeout):
+        start = self._sent_at if self.sent else self.clock()
+
+        with self._lock:
+            matcher.reset()
+            self._matched.clear()
+            del self._response[:]
+
+            # the response may already have arrived
+            self._response += self._pending
+            if matcher.feed(bytes(self._pending)):
+                self._matched.set()
+            else:
+                self._matcher = matcher
+            del self._pending[:]
+
+        ok = self._matched.wait(max(0, start + timeout - self.clock()))
+        end = self.clock()
+
+        with self._lock:
+            self._matcher = None
+            response = bytes(self._response)
+
+        result = {
+            'ok': ok and not self._stop.is_set(),
+            'latency': end - start,
+            'response': response[:256].decode('latin1'),
+        }
+        self.results.append(result)
+
+        if self.on_result:
+            self.on_result(result)
+
+        # waiting consumes time, the schedule continues from here
+        self.deadline = max(self.deadline, end)
+
+    def summary(self):
+        latencies = sorted(r['latency'] for r in self.results if r['ok'])
+        summary = {
+            'sent': self.sent,
+            'responses': len(latencies),
+            'timeouts': len(self.results) - len(latencies),
+            'late': self.late,
+        }
+        summary.update(latency_summary(latencies))
+
+        return summary
@@ -0,0 +1,112 @@
+import json
+import re
+
+from .util import escape_8bit, parse_8bit
+
+FORMAT = 'portflakes-sequences'
+VERSION = 1
+
+HTS_BYTE = re.compile(r'h\[([0-9A-Fa-f]{2})\]')
+
+
+class SequenceLibrary(object):
+    # Stores every sequence as display text together with its precompiled
+    # bytes, so sending never needs to parse escapes again.
+
+    def __init__(self):
+        self.entries = []
+        self.index = {}
+        self.scripts = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def add(self, name, text=None, data=None):
+        if data is None:
+            data = parse_8bit(text)
+        if text is None:
+            text = escape_8bit(data)
+
+        self.entries.append((name, text, data))
+        self.index[name] = data
+
+    def get(self, name):
+        return self.index[name]
+
+    @classmethod
+    def from_json(cls, obj):
+        lib = cls()
+
+        # plain lists are the original [name, sequence] format, which may
+        # also hold scripts
+        if isinstance(obj, list):
+            for entry in obj:
+                if isinstance(entry, dict):
+                    lib.scripts[entry['name']] = entry['script']
+                else:
+                    lib.add(*entry)
+            return lib
+
+        if obj.get('format') != FORMAT:
+            raise ValueError('Not a sequence library')
+
+        for entry in obj['sequences']:
+            lib.add(entry['name'], entry['text'],
+                    bytes.fromhex(entry['data']))
+        lib.scripts.update(obj.get('scripts', {}))
+
+        return lib
+
+    @classmethod
+    def load(cls, f):
+        return cls.from_json(json.load(f))
+
+    def to_json(self):
+        obj = {
+            'format': FORMAT,
+            'version': VERSION,
+            'sequences': [{'name': name, 'text': text, 'data': data.hex()}
+                          for name, text, data in self.entries],
+        }
+
+        if self.scripts:
+            obj['scripts'] = self.scripts
+
+        return obj
+
+    def dump(self, f):
+        json.dump(self.to_json(), f, indent=2)
+
+
+def parse_hts_value(value):
+    hexes = []
+    for token in value.split():
+        m = HTS_BYTE.fullmatch(token)
+        if m is None:
+            raise ValueError('Cannot parse {!r}'.format(token))
+        hexes.append(m.group(1))
+
+    return bytes.fromhex(''.join(hexes))
+
+
+def import_hts(f):
+    from xml.etree.ElementTree import iterparse
+
+    lib = SequenceLibrary()
+
+    # stream the file, dropping every item once converted
+    for _, elem in iterparse(f):
+        if elem.tag != 'SequenceItem':
+            continue
+
+        lib.add(elem.attrib['name'],
+                data=parse_hts_value(elem.find('sequence').attrib['value']))
+        elem.clear()
+
+    return lib
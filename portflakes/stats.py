@@ -0,0 +1,228 @@
+import threading
+import time
+
+
+class Histogram(object):
+    # Power-of-two buckets over integers (byte counts or nanoseconds), so
+    # adding a value is a bit_length() and an increment.
+
+    def __init__(self):
+        self.counts = [0] * 65
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        self.counts[min(64, value.bit_length())] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        # upper bound of the bucket holding the p-th percentile
+        if not self.count:
+            return None
+
+        rank = self.count * p / 100.0
+        seen = 0
+        for bucket, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.max, (1 << bucket) - 1)
+
+        return self.max
+
+    def to_json(self, scale=1):
+        if not self.count:
+            return {'count': 0}
+
+        return {
+            'count': self.count,
+            'avg': self.total / self.count * scale,
+            'p50': self.percentile(50) * scale,
+            'p99': self.percentile(99) * scale,
+            'max': self.max * scale,
+            # (upper bound, count) pairs
+            'buckets': [[((1 << b) - 1) * scale, n]
+                        for b, n in enumerate(self.counts) if n],
+        }
+
+
+class HistogramReaders(object):
+    # Lets several readers take histograms at their own pace. Taking swaps
+    # in fresh histograms on obj, whatever was collected meanwhile is merged
+    # into what every other reader has yet to see. A new reader starts with
+    # everything collected so far. If the histograms are filled from other
+    # threads, they must hold lock while adding.
+
+    def __init__(self, obj, names, lock=None):
+        self.obj = obj
+        self.names = names
+        self.lock = lock
+        self._total = {n: Histogram() for n in names}
+        self._unseen = {}
+
+    def take(self, reader):
+        if reader not in self._unseen:
+            self._unseen[reader] = {n: Histogram() for n in self.names}
+            for name in self.names:
+                self._unseen[reader][name].merge(self._total[name])
+
+        if self.lock is not None:
+            with self.lock:
+                taken = self._swap()
+        else:
+            taken = self._swap()
+
+        for name, hist in taken:
+            self._total[name].merge(hist)
+            for unseen in self._unseen.values():
+                unseen[name].merge(hist)
+
+        taken = self._unseen[reader]
+        self._unseen[reader] = {n: Histogram() for n in self.names}
+        return taken
+
+    def _swap(self):
+        taken = []
+        for name in self.names:
+            taken.append((name, getattr(self.obj, name)))
+            setattr(self.obj, name, Histogram())
+        return taken
+
+
+class IOStats(object):
+    # Counters kept by a BackgroundIO, written from its io threads and the
+    # delivery timer, hence the lock. snapshot() is taken from elsewhere and
+    # describes the interval since the same reader's previous one.
+
+    def __init__(self):
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.reads = 0
+        self.writes = 0
+
+        # bytes lost to full buffers, by signal
+        self.lost = {}
+
+        self.read_sizes = Histogram()
+        self.delivery = Histogram()
+        self.batch_sizes = Histogram()
+
+        self._lock = threading.Lock()
+        self._readers = HistogramReaders(
+            self, ('read_sizes', 'delivery', 'batch_sizes'), self._lock)
+        self._start = (time.monotonic(), 0, 0)
+        self._last = {}
+
+    def received(self, n):
+        with self._lock:
+            self.bytes_in += n
+            self.reads += 1
+            self.read_sizes.add(n)
+
+    def sent(self, n):
+        with self._lock:
+            self.bytes_out += n
+            self.writes += 1
+
+    def dropped(self, signal, n):
+        with self._lock:
+            self.lost[signal] = self.lost.get(signal, 0) + n
+
+    def flushed(self, chunks):
+        with self._lock:
+            self.batch_sizes.add(chunks)
+
+    def delivered(self, latency):
+        with self._lock:
+            self.delivery.add(latency)
+
+    def snapshot(self, reader=None):
+        now = time.monotonic()
+        with self._lock:
+            bytes_in, bytes_out = self.bytes_in, self.bytes_out
+            reads, writes = self.reads, self.writes
+            lost = dict(self.lost)
+
+        last, last_in, last_out = self._last.get(reader, self._start)
+        elapsed = max(now - last, 1e-9)
+        self._last[reader] = (now, bytes_in, bytes_out)
+
+        hists = self._readers.take(reader)
+        read_sizes = hists['read_sizes']
+        delivery = hists['delivery']
+        batch_sizes = hists['batch_sizes']
+
+        return {
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+            'in_per_sec': (bytes_in - last_in) / elapsed,
+            'out_per_sec': (bytes_out - last_out) / elapsed,
+            'reads': reads,
+            'writes': writes,
+            'dropped_in': lost.get('data-received', 0),
+            'dropped_out': lost.get('data-sent', 0),
+            'dropped_frames': lost.get('frame-received', 0),
+            'read_size': read_sizes.to_json(),
+            'read_to_render': delivery.to_json(1e-9),
+            'chunks_per_flush': batch_sizes.to_json(),
+        }
+
+
+def latency_summary(latencies, scale=1):
+    # min/avg/p50/p99/max of a sorted list
+    if not latencies:
+        return {}
+
+    return {
+        'min': latencies[0] * scale,
+        'avg': sum(latencies) / len(latencies) * scale,
+        'p50': latencies[len(latencies) // 2] * scale,
+        'p99': latencies[min(len(latencies) - 1,
+                             int(len(latencies) * 0.99))] * scale,
+        'max': latencies[-1] * scale,
+    }
+
+
+def format_rate(n):
+    for unit in ('B/s', 'kB/s', 'MB/s'):
+        if n < 1000:
+            break
+        n /= 1000.0
+    return '{:.1f} {}'.format(n, unit)
+
+
+def format_stats(stats):
+    # one line for the header bar
+    text = 'in {}  out {}  queue {}'.format(format_rate(stats['in_per_sec']),
+                                           format_rate(stats['out_per_sec']),
+                                           stats['send_queue'])
+
+    dropped = stats['dropped_in'] + stats['dropped_out']
+    if dropped:
+        text += '  dropped {} B'.format(dropped)
+
+    if stats.get('behind_schedule'):
+        text += '  behind schedule {}x'.format(stats['behind_schedule'])
+
+    bad = stats.get('frame_errors', 0) + stats.get('frame_overflows', 0)
+    if bad:
+        text += '  bad frames {}'.format(bad)
+
+    lag = stats['read_to_render']
+    if lag['count']:
+        text += '  lag p99 {:.1f} ms'.format(lag['p99'] * 1000)
+
+    append = stats.get('append_time')
+    if append and append['count']:
+        text += '  append p99 {:.2f} ms'.format(append['p99'] * 1000)
+
+    return text
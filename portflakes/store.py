@@ -0,0 +1,146 @@
+import struct
+import tempfile
+import time
+
+SPILL_HEADER = struct.Struct('<dBI')
+DIRECTIONS = ('in', 'out')
+
+
+class ChunkStore(object):
+    def __init__(self, max_bytes=None, max_lines=None, spill=False,
+                 low_water=0.75):
+        self.max_bytes = max_bytes
+        self.max_lines = max_lines
+        self.low_water = low_water
+
+        # (data, direction, timestamp) tuples; chunks[0] has index self.first
+        self.chunks = []
+        self.first = 0
+        self.size = 0
+        self.lines = 0
+
+        # allowance for data explicitly paged back in by the user
+        self.extra_bytes = 0
+        self.extra_lines = 0
+
+        self.spill_file = tempfile.TemporaryFile() if spill else None
+        self._spill_batches = []
+
+    @property
+    def end(self):
+        return self.first + len(self.chunks)
+
+    def append(self, data, direction, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+
+        self.chunks.append((data, direction, timestamp))
+        self.size += len(data)
+        self.lines += data.count(b'\n')
+
+    def clear(self):
+        self.first += len(self.chunks)
+        self.chunks = []
+        self.size = self.lines = 0
+        self.release()
+
+        if self.spill_file is not None:
+            self.spill_file.truncate(0)
+            self._spill_batches = []
+
+    def get(self, start, stop):
+        return self.chunks[start - self.first:stop - self.first]
+
+    def over_limit(self):
+        if self.max_bytes is not None:
+            if self.size > self.max_bytes + self.extra_bytes:
+                return True
+
+        if self.max_lines is not None:
+            if self.lines > self.max_lines + self.extra_lines:
+                return True
+
+        return False
+
+    def _within_low_water(self, size, lines):
+        if self.max_bytes is not None:
+            if size > self.max_bytes * self.low_water:
+                return False
+
+        if self.max_lines is not None:
+            if lines > self.max_lines * self.low_water:
+                return False
+
+        return True
+
+    def trim(self):
+        # drop a large batch at once, so the views are only rewritten rarely
+        self.extra_bytes = self.extra_lines = 0
+        size, lines = self.size, self.lines
+
+        n = 0
+        while n < len(self.chunks) - 1 and not self._within_low_water(size,
+                                                                      lines):
+            data = self.chunks[n][0]
+            size -= len(data)
+            lines -= data.count(b'\n')
+            n += 1
+
+        if n and self.spill_file is not None:
+            self._spill(self.chunks[:n])
+
+        del self.chunks[:n]
+        self.first += n
+        self.size, self.lines = size, lines
+
+        return n
+
+    def _spill(self, chunks):
+        f = self.spill_file
+        f.seek(0, 2)
+        self._spill_batches.append(f.tell())
+
+        buf = bytearray()
+        for data, direction, timestamp in chunks:
+            buf += SPILL_HEADER.pack(timestamp, DIRECTIONS.index(direction),
+                                     len(data))
+            buf += data
+        f.write(buf)
+
+    @property
+    def has_spilled(self):
+        return bool(self._spill_batches)
+
+    def page_in(self):
+        if not self._spill_batches:
+            return []
+
+        f = self.spill_file
+        offset = self._spill_batches.pop()
+        f.seek(offset)
+        buf = f.read()
+        f.truncate(offset)
+
+        chunks = []
+        idx = 0
+        while idx < len(buf):
+            timestamp, d, length = SPILL_HEADER.unpack_from(buf, idx)
+            idx += SPILL_HEADER.size
+            chunks.append((bytes(buf[idx:idx + length]), DIRECTIONS[d],
+                           timestamp))
+            idx += length
+
+        for data, _, _ in chunks:
+            self.size += len(data)
+            self.lines += data.count(b'\n')
+            self.extra_bytes += len(data)
+            self.extra_lines += data.count(b'\n')
+
+        self.chunks[0:0] = chunks
+        self.first -= len(chunks)
+
+        return chunks
+
+    def release(self):
+        # give up the allowance granted by page_in
+        self.extra_bytes = self.extra_lines = 0
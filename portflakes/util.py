@@ -1,6 +1,34 @@
+import time
+
+
 def parse_8bit(user_input):
     return user_input.encode('ascii').decode('unicode_escape').encode('latin1')
 
 
 def decode_8bit(raw):
     return raw.decode('unicode_escape')
+
+
+def escape_8bit(raw):
+    # inverse of parse_8bit
+    return raw.decode('latin1').encode('unicode_escape').decode('ascii')
+
+
+def read_chunk(ser, max_chunk=65536, coalesce=0.0):
+    # block until at least one byte arrives, then drain everything the
+    # driver has buffered in as few reads as possible
+    data = ser.read(1)
+    if not data:
+        return data
+
+    if coalesce:
+        time.sleep(coalesce)
+
+    buf = bytearray(data)
+    while len(buf) < max_chunk:
+        waiting = ser.in_waiting
+        if not waiting:
+            break
+        buf += ser.read(min(waiting, max_chunk - len(buf)))
+
+    return bytes(buf)